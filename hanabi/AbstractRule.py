@@ -1,10 +1,16 @@
 import random
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, FrozenSet
 
 from PlayerGameState import PlayerGameState
 from user_constants import ClientAction
 
+# Hint token situations distinguished by the static analysis of rules, see GeneticAgent.find_unreachable_rules
+NO_HINT_TOKENS = 'no_hint_tokens'
+SOME_HINT_TOKENS = 'some_hint_tokens'
+ALL_HINT_TOKENS = 'all_hint_tokens'
+ALL_TOKEN_STATES = frozenset({NO_HINT_TOKENS, SOME_HINT_TOKENS, ALL_HINT_TOKENS})
+
 
 class AbstractRule(ABC):
     @abstractmethod
@@ -29,6 +35,14 @@ class AbstractRule(ABC):
     def create_random():
         pass
 
+    def always_fires_in(self) -> FrozenSet[str]:
+        """ Token states in which apply never returns None. Conservative, the empty set is always correct. """
+        return frozenset()
+
+    def shadows(self, later_rule) -> bool:
+        """ True if later_rule, placed after this rule, can only fire when this rule fires as well. """
+        return False
+
 
 def mutate_probability(probability, sigma):
     return min(1, max(0, probability + random.gauss(0, sigma)))
@@ -15,8 +15,10 @@ class Agent(ABC):
     def register_hint(self, hint: GameData.ServerHintData):
         self.player_game_state.register_hint(hint)
 
-    def register_card_play(self, play: GameData.ServerPlayerMoveOk):
-        self.player_game_state.register_card_played(play.cardHandIndex)
+    def register_card_play(self, play: Union[GameData.ServerPlayerMoveOk, GameData.ServerPlayerThunderStrike,
+                                             GameData.ServerActionValid]):
+        """ Called for plays, failed plays and discards, which all remove a card from the hand of lastPlayer. """
+        self.player_game_state.register_card_played(play.lastPlayer, play.cardHandIndex, play.handLength)
 
     def update_game_state(self, game_state: GameData.ServerGameStateData):
         self.player_game_state.update_game_state(game_state)
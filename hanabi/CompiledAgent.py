@@ -0,0 +1,111 @@
+import math
+import random
+from typing import List, Callable, Tuple, Optional
+
+import GameData
+from AbstractRule import AbstractRule, NO_HINT_TOKENS, SOME_HINT_TOKENS, ALL_HINT_TOKENS
+from Agent import Agent
+from DiscardRule import DiscardRule
+from GeneticAgent import GeneticAgent
+from HintRule import HintRule
+from PlayRule import PlayRule
+from PlayerGameState import PlayerGameState, CardStatistic, NUM_HINT_TOKENS
+from instrumentation import METRICS
+from user_constants import ClientAction, POLICY_TABLE_RESOLUTION
+
+
+def token_state(hint_tokens: int) -> str:
+    if hint_tokens == 0:
+        return NO_HINT_TOKENS
+    elif hint_tokens == NUM_HINT_TOKENS:
+        return ALL_HINT_TOKENS
+    return SOME_HINT_TOKENS
+
+
+def quantize(probability: float, resolution: int) -> int:
+    return min(resolution, max(0, int(probability * resolution)))
+
+
+def threshold_bin(threshold: float, resolution: int) -> int:
+    """ Lowest bin passing threshold, probability >= ceil(threshold * resolution) / resolution <=> bin >= result. """
+    return math.ceil(threshold * resolution)
+
+
+def table_resolution_genome(encoded_genome: dict, resolution: int = POLICY_TABLE_RESOLUTION) -> dict:
+    """ Encoded genome with the play and discard thresholds rounded up to the bins of its CompiledAgent. """
+    rules = [dict(rule, threshold=threshold_bin(rule['threshold'], resolution) / resolution) if 'threshold' in rule
+             else dict(rule) for rule in encoded_genome['rules']]
+    return dict(encoded_genome, rules=rules)
+
+
+class CompiledAgent(Agent):
+    """
+    A GeneticAgent compiled into lookup tables. Own hand rules only compare the playable or useless probability of the
+    selected cards with their threshold, so the bin of a probability indexes a bitmask of the rules the card qualifies
+    for. A decision ORs the masks of the cards every criterion selects and takes the first firing rule.
+    Hint rules depend on the teammates' hands, they are tried in order through HintRule.apply.
+    Decisions are the ones of the rule walk with thresholds rounded up to multiples of 1 / resolution.
+    """
+
+    def __init__(self, agent: GeneticAgent, resolution: int = POLICY_TABLE_RESOLUTION):
+        super().__init__(agent.name)
+        self.resolution = resolution
+        self.rule_fire_counts = agent.rule_fire_counts  # shared, so that the agent sees the rules fired when compiled
+        # the rules of the agent followed by the fallback of GeneticAgent.random_hint_or_discard
+        self.rules: List[AbstractRule] = agent.rules + [HintRule(5), DiscardRule(6, 0)]
+        self.play_table = [0] * (resolution + 1)  # bin of is_playable -> bitmask of the play rules the card passes
+        self.discard_table = [0] * (resolution + 1)  # bin of is_useless -> bitmask of the discard rules
+        self.hint_rules_mask = 0
+        criterion_masks = {}
+        self.token_masks = {state: 0 for state in (NO_HINT_TOKENS, SOME_HINT_TOKENS, ALL_HINT_TOKENS)}
+        for rule_index, rule in enumerate(self.rules):
+            rule_bit = 1 << rule_index
+            for state in self.token_masks:
+                if not (type(rule) is HintRule and state == NO_HINT_TOKENS) and \
+                        not (type(rule) is DiscardRule and state == ALL_HINT_TOKENS):
+                    self.token_masks[state] |= rule_bit
+            if type(rule) is HintRule:
+                self.hint_rules_mask |= rule_bit
+                continue
+            table = self.play_table if type(rule) is PlayRule else self.discard_table
+            for probability_bin in range(threshold_bin(rule.threshold, resolution), resolution + 1):
+                table[probability_bin] |= rule_bit
+            criterion_masks[rule.select_criterion] = criterion_masks.get(rule.select_criterion, 0) | rule_bit
+        self.criterion_masks: List[Tuple[Callable[[PlayerGameState], List[int]], int]] = list(criterion_masks.items())
+
+    def choose_action(self) -> ClientAction:
+        METRICS.count('decisions')
+        with METRICS.span('decision'):
+            state = self.player_game_state
+            hand_statistics = state.get_own_hand_statistics()
+            qualify = [self.play_table[quantize(statistic.is_playable, self.resolution)]
+                       | self.discard_table[quantize(statistic.is_useless, self.resolution)]
+                       for statistic in hand_statistics]
+            fires = self.hint_rules_mask
+            selections = {}
+            for criterion, rules_mask in self.criterion_masks:
+                selections[criterion] = criterion(state)
+                for slot in selections[criterion]:
+                    fires |= rules_mask & qualify[slot]
+            fires &= self.token_masks[token_state(state.hint_tokens)]
+            while fires:
+                rule_bit = fires & -fires
+                rule_index = rule_bit.bit_length() - 1
+                action = self.rule_action(rule_index, selections, qualify, hand_statistics)
+                if action is not None:
+                    if rule_index < len(self.rule_fire_counts):
+                        self.rule_fire_counts[rule_index] += 1
+                    return action
+                fires ^= rule_bit
+            return None
+
+    def rule_action(self, rule_index: int, selections: dict, qualify: List[int],
+                    hand_statistics: List[CardStatistic]) -> Optional[ClientAction]:
+        rule = self.rules[rule_index]
+        if type(rule) is HintRule:
+            return rule.apply(self.player_game_state)
+        possible_indices = [slot for slot in selections[rule.select_criterion] if qualify[slot] >> rule_index & 1]
+        if type(rule) is PlayRule:
+            return GameData.ClientPlayerPlayCardRequest(
+                self.name, max(possible_indices, key=lambda slot: hand_statistics[slot].is_playable))
+        return GameData.ClientPlayerDiscardCardRequest(self.name, random.choice(possible_indices))
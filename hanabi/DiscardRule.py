@@ -2,8 +2,8 @@ import random
 from typing import Dict, Callable, List, Optional
 
 import GameData
-from AbstractRule import AbstractRule, mutate_probability
-from PlayRule import get_last_hinted, get_newest, get_oldest, get_highest, get_lowest, get_random
+from AbstractRule import AbstractRule, mutate_probability, NO_HINT_TOKENS, SOME_HINT_TOKENS
+from PlayRule import get_last_hinted, get_newest, get_oldest, get_highest, get_lowest, get_random, NON_EMPTY_CRITERIA
 from PlayerGameState import PlayerGameState
 from user_constants import MUTATE_RULE_THRESHOLD_SIGMA, MUTATE_RULE_LOGIC_PROB
 
@@ -43,6 +43,15 @@ class DiscardRule(AbstractRule):
     def create_random():
         return DiscardRule(random.choice(list(DiscardRuleCriterionDeserializer.keys())), random.random())
 
+    def always_fires_in(self):
+        if self.threshold <= 0 and self.select_criterion in NON_EMPTY_CRITERIA:
+            return frozenset({NO_HINT_TOKENS, SOME_HINT_TOKENS})
+        return frozenset()
+
+    def shadows(self, later_rule) -> bool:
+        return type(later_rule) is DiscardRule and later_rule.select_criterion is self.select_criterion \
+            and later_rule.threshold >= self.threshold
+
 
 DiscardRuleCriterionSerializer: Dict[Callable[[PlayerGameState], List[int]], int] = {
     get_last_hinted: 1,
@@ -108,6 +108,34 @@ class ClientPlayerPlayCardRequest(ClientToServerData):
         self.handCardOrdered = handCardOrdered
         super().__init__(sender, action)
 
+class ClientJoinTableRequest(ClientToServerData):
+    '''
+    Used by bots to join the lobby already ready to play, in place of
+    ClientPlayerAddData, ClientPlayerStartRequest and ClientPlayerReadyData.
+    The server answers ServerStartGameData once the table is full, or ServerActionInvalid.
+    seats: names of the players sitting at this connection, [sender] if None.
+        Requests of a seat must have its name as sender.
+    numPlayers: the game does not start until the table has this many players.
+    seed: seed of the deal (None for a random deal).
+    '''
+    def __init__(self, sender, seats=None, numPlayers=0, seed=None) -> None:
+        action = "Join table request"
+        self.seats = [sender] if seats is None else seats
+        self.numPlayers = numPlayers
+        self.seed = seed
+        super().__init__(sender, action)
+
+class ClientNextGameRequest(ClientToServerData):
+    '''
+    Used, once a game is over, to play another one with the same players and connections.
+    The next game starts when every player asked for it, the server answers with ServerStartGameData.
+    seed: seed of the deal, the one of the first player asking is used (None for a random deal).
+    '''
+    def __init__(self, sender, seed=None) -> None:
+        action = "Next game request"
+        self.seed = seed
+        super().__init__(sender, action)
+
 # Server to client
 class ServerToClientData(GameData):
     def __init__(self, action) -> None:
@@ -195,6 +223,17 @@ class ServerGameStateData(ServerToClientData):
         self.discardPile = discard
         super().__init__(action)
 
+    # ! ADDED game.Game serves the same object until the state changes, so it is pickled once
+    def serialize(self) -> bytes:
+        if self.__dict__.get('_serialized') is None:
+            self._serialized = super().serialize()
+        return self._serialized
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_serialized', None)
+        return state
+
 
 class ServerActionValid(ServerToClientData):
     '''
@@ -1,16 +1,20 @@
+import hashlib
+import json
 import random
 from abc import ABC, abstractmethod
 from enum import Enum
 from typing import Optional, List
 
 import GameData
-from AbstractRule import AbstractRule
+from AbstractRule import AbstractRule, ALL_TOKEN_STATES
 from Agent import Agent
 from DiscardRule import DiscardRule
 from HintRule import HintRule
 from PlayRule import PlayRule
 from PlayerGameState import PlayerGameState
-from user_constants import ClientAction, DROP_RULE_PROB, MOVE_RULE_UP_PROB, CREATE_NEW_RULE_PROB
+from instrumentation import METRICS
+from user_constants import ClientAction, DROP_RULE_PROB, MOVE_RULE_UP_PROB, CREATE_NEW_RULE_PROB, \
+    DROP_UNUSED_RULE_PROB
 
 RuleTypeDeserializer = {
     1: PlayRule,
@@ -19,19 +23,57 @@ RuleTypeDeserializer = {
 }
 
 
+def find_unreachable_rules(rules: List[AbstractRule]) -> List[int]:
+    """ Indices of the rules that never fire, because the rules before them always fire first. """
+    unreachable = []
+    reachable_rules = []
+    uncovered_token_states = set(ALL_TOKEN_STATES)
+    for index, rule in enumerate(rules):
+        if len(uncovered_token_states) == 0 or any(earlier_rule.shadows(rule) for earlier_rule in reachable_rules):
+            unreachable.append(index)
+        else:
+            reachable_rules.append(rule)
+            uncovered_token_states -= rule.always_fires_in()
+    return unreachable
+
+
+def decode_rule(encoded_rule: dict) -> AbstractRule:
+    return RuleTypeDeserializer[encoded_rule['rule_type']].from_json_encoded(encoded_rule)
+
+
+def hash_rules(encoded_rules: List[dict]) -> str:
+    """ Genome hash of encoded rules, see GeneticAgent.genome_hash. """
+    return hashlib.sha1(json.dumps(encoded_rules, sort_keys=True).encode()).hexdigest()
+
+
 class GeneticAgent(Agent):
-    def __init__(self, player_name: str, rules: List[AbstractRule] = None):
+    def __init__(self, player_name: str, rules: List[AbstractRule] = None, rule_fire_counts: List[int] = None):
+        """ Unreachable rules are stripped, so equivalent genomes have the same rules. """
         super().__init__(player_name)
         if rules is None:
             rules = []
-        self.rules: List[AbstractRule] = rules
+        if rule_fire_counts is None:
+            rule_fire_counts = [0] * len(rules)
+        unreachable = set(find_unreachable_rules(rules))
+        self.rules: List[AbstractRule] = [rule for i, rule in enumerate(rules) if i not in unreachable]
+        # how often each rule fired during evaluation, used to drop unused rules when mutating
+        self.rule_fire_counts: List[int] = [count for i, count in enumerate(rule_fire_counts) if i not in unreachable]
 
     def choose_action(self) -> ClientAction:
-        for rule in self.rules:
-            action = rule.apply(self.player_game_state)
-            if action is not None:
-                return action
-        return self.random_hint_or_discard()
+        METRICS.count('decisions')
+        with METRICS.span('decision'):
+            for index, rule in enumerate(self.rules):
+                action = rule.apply(self.player_game_state)
+                if action is not None:
+                    self.rule_fire_counts[index] += 1
+                    return action
+            return self.random_hint_or_discard()
+
+    def add_rule_fire_counts(self, rule_fire_counts: List[int]):
+        self.rule_fire_counts = [count + other for count, other in zip(self.rule_fire_counts, rule_fire_counts)]
+
+    def genome_hash(self) -> str:
+        return hash_rules(self.to_json_encoded()['rules'])
 
     def random_hint_or_discard(self) -> ClientAction:
         action = HintRule(5).apply(self.player_game_state)
@@ -41,7 +83,10 @@ class GeneticAgent(Agent):
             return DiscardRule(6, 0).apply(self.player_game_state)
 
     def mutate(self):
-        self.rules = [rule for rule in self.rules if random.random() > DROP_RULE_PROB]
+        was_evaluated = sum(self.rule_fire_counts) > 0
+        self.rules = [rule for rule, fire_count in zip(self.rules, self.rule_fire_counts)
+                      if random.random() > (DROP_UNUSED_RULE_PROB if was_evaluated and fire_count == 0
+                                            else DROP_RULE_PROB)]
         for rule in self.rules:
             rule.mutate()
         for rule_index in range(1, len(self.rules)):
@@ -50,12 +95,16 @@ class GeneticAgent(Agent):
         if random.random() < CREATE_NEW_RULE_PROB:
             self.rules.insert(random.randint(0, len(self.rules)),
                               RuleTypeDeserializer[random.randint(1, 3)].create_random())
+        unreachable = set(find_unreachable_rules(self.rules))
+        self.rules = [rule for i, rule in enumerate(self.rules) if i not in unreachable]
+        self.rule_fire_counts = [0] * len(self.rules)
 
     def crossover(self, new_player_name: str, other):
+        """ Fire counts are inherited with the rules, so that the offspring's mutation can drop unused ones. """
         cut_index = random.randint(0, min(len(self.rules), len(other.rules)))
-        return GeneticAgent.from_json_encoded(new_player_name,
-                                              self.to_json_encoded()['rules'][:cut_index] +
-                                              other.to_json_encoded()['rules'][cut_index:])
+        encoded_rules = self.to_json_encoded()['rules'][:cut_index] + other.to_json_encoded()['rules'][cut_index:]
+        return GeneticAgent(new_player_name, [decode_rule(encoded_rule) for encoded_rule in encoded_rules],
+                            self.rule_fire_counts[:cut_index] + other.rule_fire_counts[cut_index:])
 
     def to_json_encoded(self):
         return {'name': self.name, 'rules': [rule.to_json_encoded() for rule in self.rules]}
@@ -63,5 +112,4 @@ class GeneticAgent(Agent):
     @staticmethod
     def from_json_encoded(encoded_object: dict):
         return GeneticAgent(encoded_object['name'],
-                            [RuleTypeDeserializer[encoded_rule['rule_type']].from_json_encoded(encoded_rule)
-                             for encoded_rule in encoded_object['rules']])
+                            [decode_rule(encoded_rule) for encoded_rule in encoded_object['rules']])
@@ -0,0 +1,92 @@
+import math
+from typing import List, Dict, Optional
+
+import GameData
+from PlayerGameState import PlayerGameState, Card, CardHints, COLORS, VALUES, COLOR_MASKS, VALUE_MASKS
+from user_constants import HintType
+
+# (hint type, hint value, card type mask) of the 10 possible hints to a player
+HINT_KINDS = [(HintType.COLOR.value, color.value, COLOR_MASKS[color]) for color in COLORS] \
+             + [(HintType.VALUE.value, value, VALUE_MASKS[value]) for value in VALUES]
+LOG2 = [0.] + [math.log2(count) for count in range(1, 26)]
+TARGET_WEIGHT = 4.
+
+
+def popcount(mask: int) -> int:
+    return bin(mask).count('1')
+
+
+class HintCandidate:
+    """
+    A legal hint with the information it gives to each slot of the destination hand, in bits. A slot gains
+    log2(possibilities before / possibilities after) from the positive or negative information of the hint.
+    """
+    __slots__ = ('destination', 'hint_type', 'hint_value', 'touched_slots', 'slot_information')
+
+    def __init__(self, destination: str, hint_type: str, hint_value, touched_slots: int,
+                 slot_information: List[float]):
+        self.destination = destination
+        self.hint_type = hint_type
+        self.hint_value = hint_value
+        self.touched_slots = touched_slots  # bitmask over the hand slots the hint points at
+        self.slot_information = slot_information
+
+    def score(self, slot_weights: List[float]) -> float:
+        return sum(information * weight for information, weight in zip(self.slot_information, slot_weights))
+
+    def to_client_hint(self, sender: str) -> GameData.ClientHintData:
+        return GameData.ClientHintData(sender, self.destination, self.hint_type, self.hint_value)
+
+
+def hand_slot_masks(hand: List[Card]) -> List[int]:
+    """ For every hint of HINT_KINDS, the bitmask of the slots in hand it points at. """
+    color_slots = {color: 0 for color in COLORS}
+    value_slots = {value: 0 for value in VALUES}
+    for slot, card in enumerate(hand):
+        color_slots[card.color] |= 1 << slot
+        value_slots[card.value] |= 1 << slot
+    return [color_slots[color] for color in COLORS] + [value_slots[value] for value in VALUES]
+
+
+def enumerate_player_hints(player_name: str, hand: List[Card], hints: CardHints) -> List[HintCandidate]:
+    slot_masks = hand_slot_masks(hand)
+    before = [LOG2[popcount(possibilities)] for possibilities in hints.possibilities]
+    candidates = []
+    for (hint_type, hint_value, hint_mask), touched_slots in zip(HINT_KINDS, slot_masks):
+        if touched_slots == 0:  # hints must point at at least one card
+            continue
+        slot_information = []
+        for slot, possibilities in enumerate(hints.possibilities):
+            remaining = possibilities & (hint_mask if touched_slots >> slot & 1 else ~hint_mask)
+            slot_information.append(before[slot] - LOG2[popcount(remaining)] if remaining else 0.)
+        candidates.append(HintCandidate(player_name, hint_type, hint_value, touched_slots, slot_information))
+    return candidates
+
+
+def enumerate_hints(player_game_state: PlayerGameState) -> List[HintCandidate]:
+    """ Every legal hint of the current state, cached until the next hint, play or game state update. """
+    if player_game_state.hint_candidates is None:
+        player_game_state.hint_candidates = [
+            candidate
+            for player_name, hand in player_game_state.cards.player_hands.items()
+            if player_name != player_game_state.player_name and len(hand) > 0
+            for candidate in enumerate_player_hints(player_name, hand, player_game_state.teammate_hints[player_name])]
+    return player_game_state.hint_candidates
+
+
+def choose_best_hint(player_game_state: PlayerGameState, target_slots: Dict[str, int]) -> Optional[HintCandidate]:
+    """
+    Hint with the most information weighted towards the target slots (bitmask per player), among the hints that point
+    at at least one target slot. Returns None if there is no such hint.
+    """
+    slot_weights = {player_name: [TARGET_WEIGHT if targets >> slot & 1 else 1.
+                                  for slot in range(len(player_game_state.teammate_hints[player_name].possibilities))]
+                    for player_name, targets in target_slots.items()}
+    best_candidate, best_score = None, -1.
+    for candidate in enumerate_hints(player_game_state):
+        if candidate.touched_slots & target_slots.get(candidate.destination, 0) == 0:
+            continue
+        score = candidate.score(slot_weights[candidate.destination])
+        if score > best_score:
+            best_candidate, best_score = candidate, score
+    return best_candidate
@@ -1,31 +1,19 @@
 import random
-from typing import Dict, Callable, List, Optional, Tuple
+from typing import Dict, Callable, Optional
 
 import GameData
-from AbstractRule import AbstractRule, mutate_probability
-from PlayerGameState import PlayerGameState, Card, CardStatistic
+from AbstractRule import AbstractRule, mutate_probability, SOME_HINT_TOKENS, ALL_HINT_TOKENS
+from HintEngine import choose_best_hint
+from PlayerGameState import PlayerGameState, CardStatistic
 from user_constants import MUTATE_RULE_THRESHOLD_SIGMA, MUTATE_RULE_LOGIC_PROB
 
 
-def choose_card(player_hand_statistics: Dict[str, List[CardStatistic]],
-                card_filter: Callable[[CardStatistic], bool]) -> Optional[Tuple[str, Card]]:
-    candidates = []
-    for player_name, player_cards in player_hand_statistics.items():
-        for card in player_cards:
-            if card_filter(card):
-                candidates.append((player_name, card.card))
-    if len(candidates) >= 1:
-        return random.choice(candidates)
-    else:
-        return None
-
-
 HintRuleCriterionDeserializer: Dict[int, Callable[[CardStatistic], bool]] = {
     1: (lambda card_stat: card_stat.is_playable),
     2: (lambda card_stat: card_stat.is_soon_playable),
     3: (lambda card_stat: card_stat.is_useless),
     4: (lambda card_stat: card_stat.is_necessary),
-    5: (lambda card_stat: True),  # random
+    5: (lambda card_stat: True),  # any card
 }
 HintRuleCriterionSerializer: Dict[Callable[[CardStatistic], bool], int] = {
     v: k for k, v in HintRuleCriterionDeserializer.items()
@@ -39,18 +27,17 @@ class HintRule(AbstractRule):
     def apply(self, player_game_state: PlayerGameState) -> Optional[GameData.ClientHintData]:
         if player_game_state.hint_tokens == 0:
             return None
-        hint_player_card = choose_card(player_game_state.get_player_hand_statistics(), self.select_criterion)
-        if hint_player_card is not None:
-            hint_type = random.choice(['color', 'value'])
-            hint_value = hint_player_card[1].color.value if hint_type == 'color' else hint_player_card[1].value
-            return GameData.ClientHintData(
-                player_game_state.player_name,
-                hint_player_card[0],
-                hint_type,
-                hint_value
-            )
-        else:
+        target_slots = {}
+        for player_name, player_cards in player_game_state.get_player_hand_statistics().items():
+            if player_name == player_game_state.player_name:
+                continue
+            targets = sum(1 << slot for slot, card in enumerate(player_cards) if self.select_criterion(card))
+            if targets:
+                target_slots[player_name] = targets
+        if not target_slots:
             return None
+        best_hint = choose_best_hint(player_game_state, target_slots)
+        return best_hint.to_client_hint(player_game_state.player_name) if best_hint is not None else None
 
     def mutate(self):
         if random.random() < MUTATE_RULE_LOGIC_PROB:
@@ -69,3 +56,13 @@ class HintRule(AbstractRule):
     @staticmethod
     def create_random():
         return HintRule(random.choice(list(HintRuleCriterionDeserializer.keys())))
+
+    def always_fires_in(self):
+        # teammates always hold cards, so a hint about any card is always possible while there are tokens
+        if self.select_criterion is HintRuleCriterionDeserializer[5]:
+            return frozenset({SOME_HINT_TOKENS, ALL_HINT_TOKENS})
+        return frozenset()
+
+    def shadows(self, later_rule) -> bool:
+        return type(later_rule) is HintRule and (later_rule.select_criterion is self.select_criterion or
+                                                 self.select_criterion is HintRuleCriterionDeserializer[5])
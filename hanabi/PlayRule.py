@@ -2,7 +2,7 @@ import random
 from typing import Dict, Callable, List, Optional
 
 import GameData
-from AbstractRule import AbstractRule, mutate_probability
+from AbstractRule import AbstractRule, mutate_probability, ALL_TOKEN_STATES
 from PlayerGameState import PlayerGameState
 from user_constants import MUTATE_RULE_THRESHOLD_SIGMA, MUTATE_RULE_LOGIC_PROB
 
@@ -21,20 +21,22 @@ def get_oldest(player_game_state: PlayerGameState) -> List[int]:
 
 def get_highest(player_game_state: PlayerGameState) -> List[int]:
     play_index = None
-    for idx in range(len(player_game_state.get_own_hand_statistics())):
-        if player_game_state.get_own_hand_statistics()[idx].card.value is not None and \
-                (play_index is None or player_game_state.get_own_hand_statistics()[idx].card.value > play_index):
+    hand_statistics = player_game_state.get_own_hand_statistics()
+    for idx in range(len(hand_statistics)):
+        if hand_statistics[idx].card.value is not None and \
+                (play_index is None or hand_statistics[idx].card.value > hand_statistics[play_index].card.value):
             play_index = idx
-    return [play_index]
+    return [] if play_index is None else [play_index]
 
 
 def get_lowest(player_game_state: PlayerGameState) -> List[int]:
     play_index = None
-    for idx in range(len(player_game_state.get_own_hand_statistics())):
-        if player_game_state.get_own_hand_statistics()[idx].card.value is not None and\
-                (play_index is None or player_game_state.get_own_hand_statistics()[idx].card.value < play_index):
+    hand_statistics = player_game_state.get_own_hand_statistics()
+    for idx in range(len(hand_statistics)):
+        if hand_statistics[idx].card.value is not None and\
+                (play_index is None or hand_statistics[idx].card.value < hand_statistics[play_index].card.value):
             play_index = idx
-    return [play_index]
+    return [] if play_index is None else [play_index]
 
 
 def get_random(player_game_state: PlayerGameState) -> List[int]:
@@ -52,13 +54,8 @@ class PlayRule(AbstractRule):
         if len(possible_indices) == 0:
             return None
         else:
-            max_playability = 0
-            play_index = 0
-            for i in possible_indices:
-                playability = player_game_state.get_own_hand_statistics()[i].is_playable
-                if playability > max_playability:
-                    max_playability = playability
-                    play_index = i
+            # the first of the most playable cards, a card that is not among the possible ones is never played
+            play_index = max(possible_indices, key=lambda i: player_game_state.get_own_hand_statistics()[i].is_playable)
             return GameData.ClientPlayerPlayCardRequest(player_game_state.player_name, play_index)
 
     def mutate(self):
@@ -81,6 +78,15 @@ class PlayRule(AbstractRule):
     def create_random():
         return PlayRule(random.choice(list(PlayRuleCriterionDeserializer.keys())), random.random())
 
+    def always_fires_in(self):
+        if self.threshold <= 0 and self.select_criterion in NON_EMPTY_CRITERIA:
+            return ALL_TOKEN_STATES
+        return frozenset()
+
+    def shadows(self, later_rule) -> bool:
+        return type(later_rule) is PlayRule and later_rule.select_criterion is self.select_criterion \
+            and later_rule.threshold >= self.threshold
+
 
 PlayRuleCriterionSerializer: Dict[Callable[[PlayerGameState], List[int]], int] = {
     get_last_hinted: 1,
@@ -93,3 +99,5 @@ PlayRuleCriterionSerializer: Dict[Callable[[PlayerGameState], List[int]], int] =
 PlayRuleCriterionDeserializer: Dict[int, Callable[[PlayerGameState], List[int]]] = {
     v: k for k, v in PlayRuleCriterionSerializer.items()
 }
+# criteria that always select at least one card
+NON_EMPTY_CRITERIA = {get_newest, get_oldest, get_random}
@@ -1,6 +1,4 @@
-from collections import Counter
 from enum import Enum
-from functools import reduce
 from typing import List, Union, Optional, Dict
 
 import GameData
@@ -62,12 +60,28 @@ class GameCards:
         self.hand_size = game_state.handSize
 
 
+def card_type_index(color: Color, value: int) -> int:
+    """ Position of a card type in the possibility bitmasks and copy count arrays. """
+    return COLORS.index(color) * 5 + value - 1
+
+
+def card_from_possibilities(possibilities: int) -> Card:
+    """ Partially known card with the color and value that all remaining possibilities agree on. """
+    colors = [color for color in COLORS if possibilities & COLOR_MASKS[color]]
+    values = [value for value in VALUES if possibilities & VALUE_MASKS[value]]
+    return Card(colors[0] if len(colors) == 1 else None, values[0] if len(values) == 1 else None)
+
+
 class CardHints:
-    """ Records information from hints about cards on hand. """
+    """
+    Records information from hints about cards on hand. For every slot, possibilities is a bitmask over the 25 card
+    types (see card_type_index) that the card can still be, narrowed by positive and negative hint information.
+    """
 
     def __init__(self, player_name: str):
         self.player_name = player_name
         self.cards_info: List[Card] = []
+        self.possibilities: List[int] = []
         self.last_hinted: List[int] = []
 
     def __str__(self):
@@ -76,122 +90,197 @@ class CardHints:
     def fill_hand(self, hand_size: int):
         while len(self.cards_info) < hand_size:
             self.cards_info.append(Card())
+            self.possibilities.append(ALL_CARD_TYPES_MASK)
 
     def record_hint(self, hint: GameData.ServerHintData):
         if hint.destination == self.player_name:
-            for pos in hint.positions:
-                if hint.type == HintType.VALUE.value:
-                    self.cards_info[pos].value = hint.value
-                elif hint.type == HintType.COLOR.value:
-                    self.cards_info[pos].color = Color(hint.value)
+            if hint.type == HintType.VALUE.value:
+                hint_mask = VALUE_MASKS[hint.value]
+            elif hint.type == HintType.COLOR.value:
+                hint_mask = COLOR_MASKS[Color(hint.value)]
+            else:
+                return
+            for pos in range(len(self.possibilities)):
+                # cards not pointed at can't have the hinted color or value
+                self.possibilities[pos] &= hint_mask if pos in hint.positions else ~hint_mask
+                self.cards_info[pos] = card_from_possibilities(self.possibilities[pos])
             self.last_hinted = hint.positions
 
-    def record_play(self, index_played: int):
+    def copy(self):
+        card_hints = CardHints(self.player_name)
+        card_hints.cards_info = list(self.cards_info)
+        card_hints.possibilities = list(self.possibilities)
+        card_hints.last_hinted = list(self.last_hinted)
+        return card_hints
+
+    def record_play(self, index_played: int, hand_length: int):
         self.cards_info.pop(index_played)
-        self.cards_info.append(Card())
+        self.possibilities.pop(index_played)
+        if len(self.cards_info) < hand_length:  # a new card was drawn
+            self.cards_info.append(Card())
+            self.possibilities.append(ALL_CARD_TYPES_MASK)
         self.last_hinted = []
 
 
 class CardEvaluator:
-    """ Class provides methods to evaluate usefulness about given cards. See CardStatistic for computed metrics. """
+    """
+    Class provides methods to evaluate usefulness about given cards. See CardStatistic for computed metrics.
+    Unseen cards are kept as copy counts per card type, indexed like the possibility bitmasks of CardHints.
+    """
 
     def __init__(self, game_cards: GameCards):
         self.__game_cards = game_cards
-        self.__unseen_cards = self.__compute_unseen_cards()
-        self.__playable_cards = self.__compute_playable_cards()
-        self.__soon_playable_cards = self.__compute_soon_playable_cards()
-        self.__useless_cards = self.__compute_useless_cards()
-        self.__necessary_cards = self.__compute_necessary_cards()
+        self.__unseen_counts = self.__compute_unseen_counts()
+        self.__pile_heights = {color: len(cards) for color, cards in game_cards.table_cards.items()}
         self.__card_statistics = self.__compute_card_statistics()
-
-    def __compute_unseen_cards(self):
-        unseen_cards = [c for c in ALL_CARDS]
-        for card_stack in self.__game_cards.table_cards.values():
-            for card in card_stack:
-                unseen_cards.remove(card)
-        for card in self.__game_cards.discarded_cards:
-            unseen_cards.remove(card)
-        for hand_cards in self.__game_cards.player_hands.values():
-            for card in hand_cards:
-                unseen_cards.remove(card)
-        return unseen_cards
-
-    def __compute_playable_cards(self) -> List[Card]:
-        return [Card(Color(color), len(cards) + 1)
-                for color, cards in self.__game_cards.table_cards.items() if len(cards) < 5]
-
-    def __compute_soon_playable_cards(self) -> List[Card]:
-        return [Card(card.color, card.value + 1) for card in self.__playable_cards if card.value + 1 <= 5]
-
-    def __compute_useless_cards(self) -> List[Card]:
-        return [card
-                for card in ALL_CARD_TYPES if card.value < len(self.__game_cards.table_cards[card.color])]
-
-    def __compute_necessary_cards(self) -> List[Card]:
-        return [card for card in ALL_CARDS if Counter(self.__unseen_cards)[card] == 1]
+        # per card type 0/1 flags in the order playable, soon playable, useless, necessary
+        self.__type_flags = [(float(statistic.is_playable), float(statistic.is_soon_playable),
+                              float(statistic.is_useless), float(statistic.is_necessary))
+                             for statistic in (self.__card_statistics[card] for card in ALL_CARD_TYPES)]
+
+    def __compute_unseen_counts(self) -> List[int]:
+        unseen_counts = list(CARD_TYPE_COPIES)
+        visible_cards = [card for card_stack in self.__game_cards.table_cards.values() for card in card_stack] \
+            + self.__game_cards.discarded_cards \
+            + [card for hand_cards in self.__game_cards.player_hands.values() for card in hand_cards]
+        for card in visible_cards:
+            unseen_counts[card_type_index(card.color, card.value)] -= 1
+        return unseen_counts
 
     def __compute_single_card_statistic(self, card: Card) -> CardStatistic:
+        pile_height = self.__pile_heights[card.color]
         return CardStatistic(card,
-                             card in self.__playable_cards,
-                             card in self.__soon_playable_cards,
-                             card in self.__useless_cards,
-                             card in self.__necessary_cards)
+                             card.value == pile_height + 1,
+                             card.value == pile_height + 2,
+                             card.value <= pile_height,
+                             self.__unseen_counts[card_type_index(card.color, card.value)] == 1)
 
     def __compute_card_statistics(self) -> Dict[Card, CardStatistic]:
         return {card: self.__compute_single_card_statistic(card) for card in ALL_CARD_TYPES}
 
+    def get_unseen_counts(self) -> List[int]:
+        """ Copies per card type that are neither on the table, in the discard pile nor in a visible hand. """
+        return list(self.__unseen_counts)
+
     def get_single_card_statistic(self, card: Card) -> CardStatistic:
         """ Get information about a known card. """
         return self.__card_statistics[card]
 
     def get_probable_card_statistic(self, unknown_card: Card) -> CardStatistic:
         """ Get information about a partially known card. """
-        possible_cards = [card for card in self.__unseen_cards if card.could_equal(unknown_card)]
-        card_counts = reduce(
-            lambda counter, card: (counter[0] + float(self.get_single_card_statistic(card).is_playable),
-                                   counter[1] + float(self.get_single_card_statistic(card).is_soon_playable),
-                                   counter[2] + float(self.get_single_card_statistic(card).is_useless),
-                                   counter[3] + float(self.get_single_card_statistic(card).is_necessary),),
-            possible_cards, (0, 0, 0, 0))
-        return CardStatistic(unknown_card,
-                             card_counts[0] / len(possible_cards),
-                             card_counts[1] / len(possible_cards),
-                             card_counts[2] / len(possible_cards),
-                             card_counts[3] / len(possible_cards))
+        possibilities = ALL_CARD_TYPES_MASK
+        if unknown_card.color is not None:
+            possibilities &= COLOR_MASKS[unknown_card.color]
+        if unknown_card.value is not None:
+            possibilities &= VALUE_MASKS[unknown_card.value]
+        return self.get_possibility_statistic(possibilities)
+
+    def get_possibility_statistic(self, possibilities: int, unseen_counts: Optional[List[int]] = None) \
+            -> CardStatistic:
+        """ Get information about a card that can be any type in the possibilities bitmask, weighted by copies. """
+        unseen_counts = self.__unseen_counts if unseen_counts is None else unseen_counts
+        total = playable = soon_playable = useless = necessary = 0.
+        possible_types = 0  # possibilities without the types of which no copy is left
+        remaining = possibilities
+        while remaining:
+            lowest_bit = remaining & -remaining
+            type_index = lowest_bit.bit_length() - 1
+            remaining ^= lowest_bit
+            count = unseen_counts[type_index]
+            if count > 0:
+                flags = self.__type_flags[type_index]
+                possible_types |= lowest_bit
+                total += count
+                playable += count * flags[0]
+                soon_playable += count * flags[1]
+                useless += count * flags[2]
+                necessary += count * flags[3]
+        if total == 0:  # hints contradict the visible cards, nothing can be inferred
+            if possibilities == ALL_CARD_TYPES_MASK:
+                return CardStatistic(Card(), 0., 0., 0., 0.)
+            return self.get_possibility_statistic(ALL_CARD_TYPES_MASK, unseen_counts)
+        return CardStatistic(card_from_possibilities(possible_types),
+                             playable / total, soon_playable / total, useless / total, necessary / total)
+
+    def get_hand_statistics(self, hand_possibilities: List[int]) -> List[CardStatistic]:
+        """ Statistics of every slot of a hand, a slot whose type is certain uses up a copy for the other slots. """
+        certain_types = [possibilities.bit_length() - 1 if possibilities & (possibilities - 1) == 0 else None
+                         for possibilities in hand_possibilities]
+        statistics = []
+        for slot, possibilities in enumerate(hand_possibilities):
+            unseen_counts = self.__unseen_counts
+            if any(type_index is not None for other_slot, type_index in enumerate(certain_types) if other_slot != slot):
+                unseen_counts = list(unseen_counts)
+                for other_slot, type_index in enumerate(certain_types):
+                    if other_slot != slot and type_index is not None and unseen_counts[type_index] > 0:
+                        unseen_counts[type_index] -= 1
+            statistics.append(self.get_possibility_statistic(possibilities, unseen_counts))
+        return statistics
 
 
 class PlayerGameState:
     def __init__(self, player_name):
         self.player_name = player_name
         self.hint_history = CardHints(player_name)
+        # what the other players know about their own cards, from the hints they received
+        self.teammate_hints: Dict[str, CardHints] = {}
         self.cards: Optional[GameCards] = None
         self.card_evaluator: Optional[CardEvaluator] = None
         self.hint_tokens = 0
         self.storm_tokens = 0
+        # cached until the next hint, play or game state update
+        self.player_hand_statistics: Optional[Dict[str, List[CardStatistic]]] = None
+        self.own_hand_statistics: Optional[List[CardStatistic]] = None
+        self.hint_candidates: Optional[list] = None  # see HintEngine.enumerate_hints
 
     def register_hint(self, hint: GameData.ServerHintData):
         self.hint_history.record_hint(hint)
-
-    def register_card_played(self, card_index: int):
-        self.hint_history.record_play(card_index)
+        for hints in self.teammate_hints.values():
+            hints.record_hint(hint)
+        self.own_hand_statistics = None
+        self.hint_candidates = None
+
+    def register_card_played(self, player_name: str, card_index: int, hand_length: int):
+        if player_name == self.player_name:
+            self.hint_history.record_play(card_index, hand_length)
+            self.own_hand_statistics = None
+        elif player_name in self.teammate_hints and card_index < len(self.teammate_hints[player_name].cards_info):
+            self.teammate_hints[player_name].record_play(card_index, hand_length)
+            self.hint_candidates = None
 
     def update_game_state(self, game_state: GameData.ServerGameStateData):
         self.cards = GameCards(game_state)
         self.hint_tokens = NUM_HINT_TOKENS - game_state.usedNoteTokens
         self.storm_tokens = game_state.usedStormTokens
         self.hint_history.fill_hand(self.cards.hand_size)
+        for player_name, player_cards in self.cards.player_hands.items():
+            if player_name != self.player_name:
+                self.teammate_hints.setdefault(player_name, CardHints(player_name)).fill_hand(len(player_cards))
         self.card_evaluator = CardEvaluator(self.cards)
+        self.player_hand_statistics = None
+        self.own_hand_statistics = None
+        self.hint_candidates = None
 
     def get_player_hand_statistics(self) -> Dict[str, List[CardStatistic]]:
-        return {player_name: [self.card_evaluator.get_single_card_statistic(Card.make_from_server_card(card))
-                              for card in player_cards]
+        if self.player_hand_statistics is None:
+            self.player_hand_statistics = {
+                player_name: [self.card_evaluator.get_single_card_statistic(card) for card in player_cards]
                 for player_name, player_cards in self.cards.player_hands.items()}
+        return self.player_hand_statistics
 
     def get_own_hand_statistics(self) -> List[CardStatistic]:
-        return [self.card_evaluator.get_probable_card_statistic(card) for card in self.hint_history.cards_info]
+        if self.own_hand_statistics is None:
+            self.own_hand_statistics = self.card_evaluator.get_hand_statistics(self.hint_history.possibilities)
+        return self.own_hand_statistics
 
 
 ALL_CARDS = [Card(color, value) for color in Color for value in [1, 1, 1, 2, 2, 3, 3, 4, 4, 5]]
 ALL_CARD_TYPES = [Card(color, value) for color in Color for value in range(1, 6)]
+COLORS = list(Color)
+VALUES = list(range(1, 6))
+CARD_TYPE_COPIES = [[1, 1, 1, 2, 2, 3, 3, 4, 4, 5].count(card.value) for card in ALL_CARD_TYPES]
+ALL_CARD_TYPES_MASK = (1 << len(ALL_CARD_TYPES)) - 1
+COLOR_MASKS = {color: sum(1 << card_type_index(color, value) for value in VALUES) for color in COLORS}
+VALUE_MASKS = {value: sum(1 << card_type_index(color, value) for color in COLORS) for value in VALUES}
 
 NUM_HINT_TOKENS = 8
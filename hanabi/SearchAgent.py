@@ -0,0 +1,229 @@
+import multiprocessing
+import random
+import time
+from typing import List, Optional, Tuple, Union
+
+import GameData
+import game
+from AbstractRule import AbstractRule
+from Agent import Agent
+from GeneticAgent import GeneticAgent, decode_rule
+from HintEngine import enumerate_hints, popcount
+from PlayerGameState import PlayerGameState, Card, ALL_CARD_TYPES, NUM_HINT_TOKENS
+from headless_game import notify_action_performed, play_until_game_over, action_key
+from instrumentation import METRICS
+from user_constants import ClientAction, SEARCH_TIME_BUDGET, SEARCH_NUM_WORKERS, SEARCH_MAX_HINT_CANDIDATES
+
+# fraction of the time budget kept for sending the snapshot to the workers and merging their results
+RESULT_MARGIN = 0.1
+# ids of sampled cards start after the ids of the 50 real cards
+SAMPLED_CARD_ID_OFFSET = 50
+
+
+def to_game_card(card: Card, card_id: int) -> game.Card:
+    return game.Card(card_id, card.value, card.color.value)
+
+
+class SearchSnapshot:
+    """
+    Everything a rollout needs from the searching player's point of view. Visible cards are converted to engine cards
+    once, the own hand and the deck are sampled for every rollout, see sample_deal.
+    """
+
+    def __init__(self, player_game_state: PlayerGameState, last_moves: Optional[int]):
+        self.player_name = player_game_state.player_name
+        self.player_names = list(player_game_state.cards.player_hands)
+        card_ids = iter(range(SAMPLED_CARD_ID_OFFSET))
+        self.hands = {player_name: [to_game_card(card, next(card_ids)) for card in hand]
+                      for player_name, hand in player_game_state.cards.player_hands.items()}
+        self.table_cards = {color.value: [to_game_card(card, next(card_ids)) for card in pile]
+                            for color, pile in player_game_state.cards.table_cards.items()}
+        self.discard_pile = [to_game_card(card, next(card_ids)) for card in player_game_state.cards.discarded_cards]
+        self.own_possibilities = player_game_state.hint_history.possibilities[:player_game_state.cards.hand_size]
+        self.card_hints = dict(player_game_state.teammate_hints)
+        self.card_hints[self.player_name] = player_game_state.hint_history
+        self.card_hints = {player_name: card_hints.copy() for player_name, card_hints in self.card_hints.items()}
+        self.unseen_counts = player_game_state.card_evaluator.get_unseen_counts()
+        self.note_tokens = NUM_HINT_TOKENS - player_game_state.hint_tokens
+        self.storm_tokens = player_game_state.storm_tokens
+        self.last_moves = last_moves
+
+
+def sample_deal(snapshot: SearchSnapshot, rng: random.Random) -> Tuple[List[game.Card], List[game.Card]]:
+    """
+    Own hand and deck consistent with the hints and the visible cards, weighted by the unseen copies. The most
+    constrained slots are filled first. If the hints can't be satisfied any more, a slot takes any unseen card.
+    """
+    counts = list(snapshot.unseen_counts)
+    own_types = [0] * len(snapshot.own_possibilities)
+    for slot in sorted(range(len(own_types)), key=lambda slot: popcount(snapshot.own_possibilities[slot])):
+        candidates = [type_index for type_index in range(len(counts))
+                      if counts[type_index] > 0 and snapshot.own_possibilities[slot] >> type_index & 1] \
+            or [type_index for type_index in range(len(counts)) if counts[type_index] > 0]
+        own_types[slot] = rng.choices(candidates, weights=[counts[type_index] for type_index in candidates])[0]
+        counts[own_types[slot]] -= 1
+    deck_types = [type_index for type_index, count in enumerate(counts) for _ in range(count)]
+    rng.shuffle(deck_types)
+    card_ids = iter(range(SAMPLED_CARD_ID_OFFSET, SAMPLED_CARD_ID_OFFSET + len(own_types) + len(deck_types)))
+    own_hand = [to_game_card(ALL_CARD_TYPES[type_index], next(card_ids)) for type_index in own_types]
+    deck = [to_game_card(ALL_CARD_TYPES[type_index], next(card_ids)) for type_index in deck_types]
+    return own_hand, deck
+
+
+def rollout(snapshot: SearchSnapshot, own_hand: List[game.Card], deck: List[game.Card], action: ClientAction,
+            policy_rules: List[AbstractRule]) -> int:
+    """ Plays action in the sampled deal, then lets every player follow the policy. Returns the final score. """
+    rollout_game = game.Game()
+    for player_name in snapshot.player_names:
+        rollout_game.addPlayer(player_name)
+    hands = dict(snapshot.hands)
+    hands[snapshot.player_name] = own_hand
+    rollout_game.loadState(hands, snapshot.table_cards, snapshot.discard_pile, deck, snapshot.note_tokens,
+                           snapshot.storm_tokens, snapshot.player_name, snapshot.last_moves)
+    agents = []
+    for player_name in snapshot.player_names:
+        agent = GeneticAgent(player_name, policy_rules)
+        agent.player_game_state.hint_history = snapshot.card_hints[player_name].copy()
+        agent.player_game_state.teammate_hints = {other_name: snapshot.card_hints[other_name].copy()
+                                                  for other_name in snapshot.player_names if other_name != player_name}
+        agent.update_game_state(
+            rollout_game.satisfyRequest(GameData.ClientGetGameStateRequest(player_name), player_name)[0])
+        agents.append(agent)
+    single_data, multiple_data = rollout_game.satisfyRequest(action, snapshot.player_name)
+    if single_data is not None:
+        return 0
+    if type(multiple_data) is GameData.ServerGameOver:
+        return multiple_data.score
+    notify_action_performed(agents, multiple_data)
+    return play_until_game_over(rollout_game, agents)
+
+
+def run_rollouts(snapshot: SearchSnapshot, actions: List[ClientAction], policy_rules: List[AbstractRule],
+                 budget: float, seed: int) -> Tuple[List[float], int]:
+    """
+    Rolls out every action on one sampled deal per round, until budget seconds passed, so that the actions are compared
+    on the same deals. Only complete rounds count. Returns the total score per action and the number of rounds.
+    The rules of the policy draw from the global generator, which is seeded for the rollouts and restored afterwards,
+    so that rollouts in the caller's process leave its random sequence alone.
+    """
+    rng = random.Random(seed)
+    caller_state = random.getstate()
+    random.seed(seed)
+    try:
+        deadline = time.monotonic() + budget
+        totals = [0.] * len(actions)
+        num_rounds = 0
+        while True:
+            own_hand, deck = sample_deal(snapshot, rng)
+            round_scores = []
+            for action in actions:
+                if time.monotonic() >= deadline:
+                    return totals, num_rounds
+                round_scores.append(rollout(snapshot, own_hand, deck, action, policy_rules))
+            totals = [total + score for total, score in zip(totals, round_scores)]
+            num_rounds += 1
+    finally:
+        random.setstate(caller_state)
+
+
+WORKER_POLICY_RULES: List[AbstractRule] = []
+
+
+def init_rollout_worker(encoded_policy_rules: List[dict]):
+    global WORKER_POLICY_RULES
+    WORKER_POLICY_RULES = [decode_rule(encoded_rule) for encoded_rule in encoded_policy_rules]
+
+
+def run_rollouts_in_worker(task: Tuple[SearchSnapshot, List[ClientAction], float, int]) \
+        -> Tuple[List[float], int]:
+    snapshot, actions, budget, seed = task
+    return run_rollouts(snapshot, actions, WORKER_POLICY_RULES, budget, seed)
+
+
+class SearchAgent(Agent):
+    """
+    Determinized Monte Carlo search: samples own hands and decks consistent with the known hints, rolls out every
+    candidate action with a rule based policy (e.g. the genome of best_agent.json) and picks the action with the best
+    mean score. Anytime, every decision takes about time_budget seconds, with rollouts spread over num_workers
+    processes.
+    """
+
+    def __init__(self, player_name: str, encoded_policy_rules: List[dict], time_budget: float = SEARCH_TIME_BUDGET,
+                 num_workers: int = SEARCH_NUM_WORKERS):
+        super().__init__(player_name)
+        self.time_budget = time_budget
+        self.policy = GeneticAgent(player_name, [decode_rule(encoded_rule) for encoded_rule in encoded_policy_rules])
+        self.policy.player_game_state = self.player_game_state
+        self.pool = multiprocessing.Pool(num_workers, initializer=init_rollout_worker,
+                                         initargs=(encoded_policy_rules,)) if num_workers > 1 else None
+        self.num_workers = num_workers
+        # the game lasts one more move per player after the deck is empty, see Game.satisfyRequest
+        self.deck_size: Optional[int] = None
+        self.moves_after_deck_empty = 0
+
+    def update_game_state(self, game_state: GameData.ServerGameStateData):
+        super().update_game_state(game_state)
+        self.deck_size = sum(self.player_game_state.card_evaluator.get_unseen_counts()) \
+            - self.player_game_state.cards.hand_size
+
+    def register_hint(self, hint: GameData.ServerHintData):
+        super().register_hint(hint)
+        self.count_move(draws_card=False)
+
+    def register_card_play(self, play: Union[GameData.ServerPlayerMoveOk, GameData.ServerPlayerThunderStrike,
+                                             GameData.ServerActionValid]):
+        super().register_card_play(play)
+        self.count_move(draws_card=True)
+
+    def count_move(self, draws_card: bool):
+        if self.deck_size is None:
+            return
+        if draws_card and self.deck_size > 0:
+            self.deck_size -= 1
+        if self.deck_size == 0:
+            self.moves_after_deck_empty += 1
+
+    def candidate_actions(self, policy_action: ClientAction) -> List[ClientAction]:
+        """ The policy's action first, so that it wins ties, then every play, discard and the most informative hints. """
+        state = self.player_game_state
+        actions = [policy_action]
+        for slot in range(state.cards.hand_size):
+            actions.append(GameData.ClientPlayerPlayCardRequest(self.name, slot))
+            if state.hint_tokens < NUM_HINT_TOKENS:
+                actions.append(GameData.ClientPlayerDiscardCardRequest(self.name, slot))
+        if state.hint_tokens > 0:
+            hints = sorted(enumerate_hints(state), key=lambda hint: -sum(hint.slot_information))
+            actions += [hint.to_client_hint(self.name) for hint in hints[:SEARCH_MAX_HINT_CANDIDATES]]
+        unique_actions = {}
+        for action in actions:
+            unique_actions.setdefault(action_key(action), action)
+        return list(unique_actions.values())
+
+    def choose_action(self) -> ClientAction:
+        start = time.monotonic()
+        with METRICS.span('search'):
+            policy_action = self.policy.choose_action()
+            actions = self.candidate_actions(policy_action)
+            if len(actions) == 1:
+                return policy_action
+            last_moves = len(self.player_game_state.cards.player_hands) + 1 - self.moves_after_deck_empty \
+                if self.deck_size == 0 else None
+            snapshot = SearchSnapshot(self.player_game_state, last_moves)
+            budget = self.time_budget * (1 - RESULT_MARGIN) - (time.monotonic() - start)
+            if self.pool is not None:
+                results = self.pool.map(run_rollouts_in_worker,
+                                        [(snapshot, actions, budget, random.getrandbits(32))
+                                         for _ in range(self.num_workers)])
+            else:
+                results = [run_rollouts(snapshot, actions, self.policy.rules, budget, random.getrandbits(32))]
+            totals = [sum(result[0][i] for result in results) for i in range(len(actions))]
+            num_rounds = sum(result[1] for result in results)
+            METRICS.count('rollouts', num_rounds * len(actions))
+            if num_rounds == 0:
+                return policy_action
+            return actions[max(range(len(actions)), key=lambda i: totals[i])]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
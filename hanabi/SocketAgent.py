@@ -1,18 +1,25 @@
 import logging
 import select
-from typing import get_args, Optional
+from typing import get_args, Optional, List
 import socket
 
 from Agent import Agent
 import GameData
 from constants import HOST, PORT, DATASIZE
+from instrumentation import METRICS
 from user_constants import ActionPerformed
 
 
 class SocketAgent:
-    def __init__(self, socket: socket, agent: Agent):
+    def __init__(self, socket: socket, agent: Agent, reserved_seats: Optional[List[Agent]] = None):
+        """
+        reserved_seats: agents of other seats played through the same connection, see join_table. self.agent is the
+        one whose turn it is.
+        """
         self.socket = socket
         self.agent = agent
+        self.agents = {seat_agent.name: seat_agent for seat_agent in [agent] + (reserved_seats or [])}
+        self.players: List[str] = []  # in turn order, see wait_for_start
         self.score = 0
         self.is_game_running = True
 
@@ -27,24 +34,77 @@ class SocketAgent:
         self.handle_unexpected_data(data, f"fUnexpected data received when {self.agent.name} tried to join the game.")
         return False
 
+    def join_table(self, num_players: int, seed: Optional[int] = None) -> Optional[str]:
+        """
+        Joins the lobby with every seat of the connection, already ready, in a single round trip. Returns the first
+        player of the game, which starts once the table has num_players players.
+        """
+        self.socket.connect((HOST, PORT))
+        self.socket.send(GameData.ClientJoinTableRequest(self.agent.name, list(self.agents), num_players,
+                                                         seed).serialize())
+        return self.wait_for_start(send_ready=False)
+
     def play_game(self):
+        with METRICS.span('handshake'):
+            current_player = self.open_session()
+        self.play_turns(current_player)
+
+    def play_table_game(self, num_players: int, seed: Optional[int] = None):
+        """ play_game, with the handshake of join_table. """
+        with METRICS.span('handshake'):
+            current_player = self.join_table(num_players, seed)
+        self.play_turns(current_player)
+
+    def open_session(self) -> Optional[str]:
+        """ Joins the lobby and waits for the first game. Returns its first player, see play_turns. """
         self.join()
         self.send_ready()
-        current_player = self.wait_for_start()
-        self.get_game_state()
+        return self.wait_for_start()
+
+    def play_next_game(self, agent: Agent, seed: Optional[int] = None, reserved_seats: Optional[List[Agent]] = None):
+        """
+        Once a game of the session is over, plays another one over the same connection, with new agents in place of
+        the previous ones. The server knows the seats by the names they joined with, so the names must be the same.
+        """
+        agents = {seat_agent.name: seat_agent for seat_agent in [agent] + (reserved_seats or [])}
+        if sorted(agents) != sorted(self.agents):
+            raise ValueError(f"Agents {list(agents)} can't play in the seats of {list(self.agents)}.")
+        self.agent = agent
+        self.agents = agents
+        self.score = 0
+        self.is_game_running = True
+        with METRICS.span('next_game'):
+            self.socket.send(GameData.ClientNextGameRequest(self.agent.name, seed).serialize())
+            current_player = self.wait_for_start(send_ready=False)
+        self.play_turns(current_player)
+
+    def play_turns(self, current_player: Optional[str]):
+        with METRICS.span('state_request'):
+            for agent in self.agents.values():
+                self.agent = agent
+                self.get_game_state()
+        # other connections have to get their first state before the first action, a connection holding every seat
+        # can act at once
+        is_waiting = not set(self.players) <= set(self.agents)
         while self.is_game_running:
             logging.debug(f"It's \"{current_player}\"'s turn.")
-            if select.select([self.socket], [], [], 2)[0]:
-                data = self.socket.recv(DATASIZE)
-                if data:
-                    data = GameData.GameData.deserialize(data)
-                    current_player = self.handle_data_received(data)
-                    if current_player is None:
-                        return
+            if is_waiting:
+                with METRICS.span('server_wait'):
+                    is_readable = select.select([self.socket], [], [], 2)[0]
+                if is_readable:
+                    data = self.socket.recv(DATASIZE)
+                    if data:
+                        data = GameData.GameData.deserialize(data)
+                        current_player = self.handle_data_received(data)
+                        if current_player is None:
+                            return
+            is_waiting = True
             print(f"player {self.agent.name}, cur: {current_player}")
-            if self.agent.name == current_player:
+            if current_player in self.agents:
+                self.agent = self.agents[current_player]
                 logging.debug(f"Player {self.agent.name} is computing his turn")
-                self.get_game_state()
+                with METRICS.span('state_request'):
+                    self.get_game_state()
                 self.socket.send(self.agent.choose_action().serialize())
 
     def send_ready(self) -> bool:
@@ -58,11 +118,14 @@ class SocketAgent:
         self.handle_unexpected_data(data, f"Unexpected data received when {self.agent.name} sent ready.")
         return False
 
-    def wait_for_start(self) -> Optional[str]:
+    def wait_for_start(self, send_ready: bool = True) -> Optional[str]:
+        """ Games after the first one of a session start in game status, there is no ready handshake to answer. """
         data = GameData.GameData.deserialize(self.socket.recv(DATASIZE))
         if type(data) is GameData.ServerStartGameData:
-            self.socket.send(GameData.ClientPlayerReadyData(self.agent.name).serialize())
+            if send_ready:
+                self.socket.send(GameData.ClientPlayerReadyData(self.agent.name).serialize())
             logging.info(f"Game has started for {self.agent.name}.")
+            self.players = data.players
             return data.players[0]
         self.handle_unexpected_data(data, f"Unexpected data received when {self.agent.name} waited for start.")
         return None
@@ -99,14 +162,20 @@ class SocketAgent:
     def handle_action_performed(self, action: ActionPerformed) -> str:
         if type(action) is GameData.ServerPlayerMoveOk:
             logging.debug(f"Card played")
-            self.agent.register_card_play(action)
+            for agent in self.agents.values():
+                agent.register_card_play(action)
         elif type(action) is GameData.ServerActionValid:
             logging.debug(f"Card discarded")
+            for agent in self.agents.values():
+                agent.register_card_play(action)
         elif type(action) is GameData.ServerHintData:
             logging.debug(f"Hint given")
-            self.agent.register_hint(action)
+            for agent in self.agents.values():
+                agent.register_hint(action)
         elif type(action) is GameData.ServerPlayerThunderStrike:
             logging.debug(f"Thunder")
+            for agent in self.agents.values():
+                agent.register_card_play(action)
         else:
             self.handle_unexpected_data(action, f"Unexpected action performed.")
         logging.debug(f"It's \"{action.player}\"'s turn")
@@ -126,3 +195,36 @@ class SocketAgent:
             logging.warning(f"Somebody performed an invalid action. {data.message}")
         else:
             logging.warning(f"Unexpected data type received. {type(data)}")
+
+
+class SocketSession:
+    """
+    A connection to the server holding num_seats seats, that stays open and plays consecutive games, see
+    SocketAgent.play_next_game. The server knows the seats by name, so the agents of every game must be named after
+    their seat, see seat_names.
+    """
+
+    def __init__(self, num_seats: int = 4):
+        self.seat_names = [f'seat{seat}' for seat in range(num_seats)]
+        self.table: Optional[SocketAgent] = None
+
+    def play_games(self, groups: List[List[Agent]], seeds: List[Optional[int]]) -> List[int]:
+        """
+        Plays one game per group, the agents in seat order, with the deal of its seed. Returns the scores. The
+        connection is opened by the first call, see SocketAgent.join_table.
+        """
+        scores = []
+        for game_index, (agents, seed) in enumerate(zip(groups, seeds)):
+            if self.table is None:
+                self.table = SocketAgent(socket.socket(socket.AF_INET, socket.SOCK_STREAM), agents[0], agents[1:])
+                self.table.play_table_game(len(self.seat_names), seed)
+            else:
+                self.table.play_next_game(agents[0], seed, agents[1:])
+            scores.append(self.table.score)
+        return scores
+
+    def close(self):
+        """ The server shuts down once every connection is closed. """
+        if self.table is not None:
+            self.table.socket.close()
+            self.table = None
@@ -0,0 +1,157 @@
+import glob
+import json
+import re
+import statistics
+from typing import Dict, List, Optional, Tuple
+
+from GeneticAgent import hash_rules
+from user_constants import SURROGATE_RIDGE_PENALTY, SURROGATE_MIN_SAMPLES
+
+NUM_PLAY_CRITERIA = 6
+NUM_DISCARD_CRITERIA = 6
+NUM_HINT_CRITERIA = 5
+
+
+def genome_features(encoded_genome: dict) -> List[float]:
+    """ Fixed length feature vector of an encoded GeneticAgent, see GeneticAgent.to_json_encoded. """
+    rules = encoded_genome['rules']
+    num_rules = len(rules)
+    type_counts = [0.] * 3
+    first_position = [1.] * 3
+    thresholds = {1: [], 3: []}
+    criterion_counts = {
+        1: [0.] * NUM_PLAY_CRITERIA,
+        2: [0.] * NUM_HINT_CRITERIA,
+        3: [0.] * NUM_DISCARD_CRITERIA,
+    }
+    for position, rule in enumerate(rules):
+        rule_type = rule['rule_type']
+        type_counts[rule_type - 1] += 1
+        first_position[rule_type - 1] = min(first_position[rule_type - 1], position / max(1, num_rules))
+        criterion_counts[rule_type][rule['criterion'] - 1] += 1
+        if rule_type in thresholds:
+            thresholds[rule_type].append(rule['threshold'])
+    features = [1., float(num_rules)] + type_counts + first_position
+    for rule_type in (1, 3):
+        rule_thresholds = thresholds[rule_type]
+        features += [min(rule_thresholds, default=1.), statistics.mean(rule_thresholds) if rule_thresholds else 1.]
+    for rule_type in (1, 2, 3):
+        features += criterion_counts[rule_type]
+    return features
+
+
+def solve_linear_system(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """ Gaussian elimination with partial pivoting, matrix is expected to be square and regular. """
+    size = len(vector)
+    augmented = [row[:] + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda row: abs(augmented[row][col]))
+        augmented[col], augmented[pivot] = augmented[pivot], augmented[col]
+        for row in range(col + 1, size):
+            factor = augmented[row][col] / augmented[col][col]
+            for k in range(col, size + 1):
+                augmented[row][k] -= factor * augmented[col][k]
+    solution = [0.] * size
+    for row in reversed(range(size)):
+        solution[row] = (augmented[row][size] - sum(augmented[row][k] * solution[k] for k in range(row + 1, size))) \
+                        / augmented[row][row]
+    return solution
+
+
+def average_ranks(values: List[float]) -> List[float]:
+    """ Ranks from 0, tied values share the mean of their ranks. """
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.] * len(values)
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+            end += 1
+        for position in range(start, end + 1):
+            ranks[order[position]] = (start + end) / 2
+        start = end + 1
+    return ranks
+
+
+def rank_correlation(first: List[float], second: List[float]) -> float:
+    """ Spearman rank correlation, with average ranks for ties, 0 if one of the inputs is constant. """
+    if len(first) < 2 or len(set(first)) == 1 or len(set(second)) == 1:
+        return 0.
+    first_ranks, second_ranks = average_ranks(first), average_ranks(second)
+    mean_rank = (len(first) - 1) / 2
+    covariance = sum((a - mean_rank) * (b - mean_rank) for a, b in zip(first_ranks, second_ranks))
+    first_variance = sum((a - mean_rank) ** 2 for a in first_ranks)
+    second_variance = sum((b - mean_rank) ** 2 for b in second_ranks)
+    return covariance / (first_variance * second_variance) ** 0.5
+
+
+def checkpoint_epoch(file_name: str) -> int:
+    match = re.search(r'(\d+)\.json$', file_name)
+    return int(match.group(1)) if match else -1
+
+
+class SurrogateModel:
+    """
+    Ridge regression predicting the score of a genome from its features, used to prescreen offspring. Every genome is
+    one sample, with the mean of the scores it was given, so survivors that play many games don't outweigh the others.
+    """
+
+    def __init__(self, ridge_penalty: float = SURROGATE_RIDGE_PENALTY, min_samples: int = SURROGATE_MIN_SAMPLES):
+        self.ridge_penalty = ridge_penalty
+        self.min_samples = min_samples
+        self.num_samples = 0
+        self.samples: Dict[str, Tuple[List[float], float, int]] = {}  # hash_rules -> features, score sum, count
+        self.gram: Optional[List[List[float]]] = None
+        self.moment: Optional[List[float]] = None
+        self.weights: Optional[List[float]] = None
+
+    def is_ready(self) -> bool:
+        return self.weights is not None
+
+    def add_sample(self, encoded_genome: dict, score: float):
+        """ Adds a genome with its score, or moves the target of a genome already added to the mean of its scores. """
+        key = hash_rules(encoded_genome['rules'])
+        if key in self.samples:
+            features, score_sum, count = self.samples[key]
+            self.samples[key] = (features, score_sum + score, count + 1)
+            change = (score_sum + score) / (count + 1) - score_sum / count
+            for i in range(len(features)):
+                self.moment[i] += features[i] * change
+            return
+        features = genome_features(encoded_genome)
+        self.samples[key] = (features, score, 1)
+        if self.gram is None:
+            self.gram = [[0.] * len(features) for _ in features]
+            self.moment = [0.] * len(features)
+        for i in range(len(features)):
+            self.moment[i] += features[i] * score
+            for j in range(len(features)):
+                self.gram[i][j] += features[i] * features[j]
+        self.num_samples += 1
+
+    def load_checkpoints(self, pattern: str = 'training_*.json') -> int:
+        """
+        Collects (genome, score) samples from checkpoints written by Population.train. Survivors appear in many
+        consecutive checkpoints, every genome is added with its score in the latest checkpoint only. Returns the number
+        of genomes read.
+        """
+        latest_samples = {}
+        for file_name in sorted(glob.glob(pattern), key=checkpoint_epoch):
+            with open(file_name, 'r') as f:
+                encoded_population = json.load(f)
+            for encoded_agent, score in zip(encoded_population['agents'], encoded_population.get('scores', [])):
+                latest_samples[hash_rules(encoded_agent['rules'])] = (encoded_agent, score)
+        for encoded_agent, score in latest_samples.values():
+            self.add_sample(encoded_agent, score)
+        return len(latest_samples)
+
+    def fit(self):
+        if self.num_samples < self.min_samples:
+            return
+        penalized_gram = [row[:] for row in self.gram]
+        for i in range(1, len(penalized_gram)):  # intercept is not penalized
+            penalized_gram[i][i] += self.ridge_penalty
+        self.weights = solve_linear_system(penalized_gram, self.moment)
+
+    def predict(self, encoded_genome: dict) -> float:
+        return sum(w * x for w, x in zip(self.weights, genome_features(encoded_genome)))
@@ -0,0 +1,244 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Callable
+
+import GameData
+from CompiledAgent import CompiledAgent
+from GeneticAgent import GeneticAgent, RuleTypeDeserializer
+from PlayerGameState import CardEvaluator, GameCards, Card
+from evolution_manager import Population, get_seeded_starting_agent
+from game import Game
+from headless_game import play_headless_game
+from user_constants import Color
+
+BENCHMARK_SEED = 1234
+BENCHMARK_GAMES = 5
+BENCHMARK_REPEATS = 5
+BENCHMARK_TOLERANCE = 0.25
+BENCHMARK_BASELINE_FILE = 'benchmark_baseline.json'
+BENCHMARK_RESULTS_FILE = 'benchmark_results.json'
+
+# Metrics ending with one of these suffixes are better when higher, every other metric is a latency.
+HIGHER_IS_BETTER_SUFFIXES = ('_per_second',)
+
+
+def median_time(function: Callable[[], None], repeats: int = BENCHMARK_REPEATS) -> float:
+    """ Median wall time of repeats runs of function, in seconds. """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def seat_agents(encoded_genome: dict) -> List[GeneticAgent]:
+    return [GeneticAgent.from_json_encoded({'name': f'seat{i}', 'rules': encoded_genome['rules']}) for i in range(4)]
+
+
+def load_best_agent() -> dict:
+    """ best_agent.json if it exists, else the seeded starting agent, so that the suite always runs. """
+    if os.path.exists('best_agent.json'):
+        with open('best_agent.json', 'r') as f:
+            return json.load(f)
+    return get_seeded_starting_agent('best').to_json_encoded()
+
+
+def random_genomes(count: int, num_rules: int = 6) -> List[dict]:
+    return [{'name': f'random{i}',
+             'rules': [RuleTypeDeserializer[random.randint(1, 3)].create_random().to_json_encoded()
+                       for _ in range(num_rules)]}
+            for i in range(count)]
+
+
+def record_game_states(encoded_genome: dict, seeds: List[int]) -> List[GameData.ServerGameStateData]:
+    """ Game states received by the agents while playing the given seeds. """
+    states = []
+    for seed in seeds:
+        random.seed(seed)
+        agents = seat_agents(encoded_genome)
+        for agent in agents:
+            update_game_state = agent.update_game_state
+            agent.update_game_state = lambda state, update=update_game_state: (states.append(state), update(state))
+        play_headless_game(agents, seed)
+    return states
+
+
+def scripted_turns(seed: int) -> int:
+    """ Plays a game straight through Game.satisfyRequest with a fixed policy, returns the number of turns. """
+    game = Game()
+    names = [f'seat{i}' for i in range(4)]
+    for name in names:
+        game.addPlayer(name)
+    game.start(seed)
+    players = {player.name: player for player in game.getPlayers()}
+    turns = 0
+    while True:
+        current = game.getCurrentPlayerName()
+        teammate = players[names[(names.index(current) + 1) % len(names)]]
+        if turns % 3 == 0:
+            action = GameData.ClientPlayerPlayCardRequest(current, 0)
+        else:
+            action = GameData.ClientHintData(current, teammate.name, 'value', teammate.hand[0].value)
+        single_data, multiple_data = game.satisfyRequest(action, current)
+        if single_data is not None:
+            single_data, multiple_data = game.satisfyRequest(GameData.ClientPlayerDiscardCardRequest(current, 0),
+                                                             current)
+        turns += 1
+        if type(multiple_data) is GameData.ServerGameOver:
+            return turns
+
+
+def benchmark_engine() -> Dict[str, float]:
+    seeds = [BENCHMARK_SEED + i for i in range(BENCHMARK_GAMES)]
+    turns = sum(scripted_turns(seed) for seed in seeds)
+    elapsed = median_time(lambda: [scripted_turns(seed) for seed in seeds])
+    return {'turns_per_second': turns / elapsed}
+
+
+def benchmark_card_evaluator(states: List[GameData.ServerGameStateData]) -> Dict[str, float]:
+    partial_cards = [Card(), Card(value=1), Card(value=5), Card(Color.RED), Card(Color.BLUE, 2)]
+    queries = [(CardEvaluator(GameCards(state)), card) for state in states for card in partial_cards]
+    construction = median_time(lambda: [CardEvaluator(GameCards(state)) for state in states])
+    statistic = median_time(lambda: [evaluator.get_probable_card_statistic(card) for evaluator, card in queries])
+    return {
+        'construction_us': construction / len(states) * 1e6,
+        'probable_statistic_us': statistic / len(queries) * 1e6,
+    }
+
+
+def benchmark_choose_action(encoded_genomes: List[dict], compiled: bool = False) -> Dict[str, float]:
+    """ Decision latencies of the genomes, or of their CompiledAgents, in headless games. """
+    latencies = []
+    for genome_index, encoded_genome in enumerate(encoded_genomes):
+        seed = BENCHMARK_SEED + genome_index
+        random.seed(seed)
+        agents = seat_agents(encoded_genome)
+        if compiled:
+            agents = [CompiledAgent(agent) for agent in agents]
+        for agent in agents:
+            def timed_choose_action(choose_action=agent.choose_action):
+                start = time.perf_counter()
+                action = choose_action()
+                latencies.append(time.perf_counter() - start)
+                return action
+            agent.choose_action = timed_choose_action
+        play_headless_game(agents, seed)
+    return {
+        'mean_us': statistics.mean(latencies) * 1e6,
+        'median_us': statistics.median(latencies) * 1e6,
+        'p95_us': percentile(latencies, 0.95) * 1e6,
+    }
+
+
+def benchmark_game_data(states: List[GameData.ServerGameStateData]) -> Dict[str, float]:
+    serialized = [state.serialize() for state in states]
+    # the encoding of a state, not its cached copy, see ServerGameStateData.serialize
+    serialize = median_time(lambda: [GameData.GameData.serialize(state) for state in states])
+    deserialize = median_time(lambda: [GameData.GameData.deserialize(data) for data in serialized])
+    return {
+        'serialize_us': serialize / len(states) * 1e6,
+        'deserialize_us': deserialize / len(states) * 1e6,
+    }
+
+
+def benchmark_evaluate_agents(encoded_genome: dict) -> Dict[str, float]:
+    """ End to end games through server.py. The server exits after every game, so each game gets a new one. """
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    elapsed = 0.
+    with tempfile.TemporaryDirectory() as server_directory:
+        for game_index in range(BENCHMARK_GAMES):
+            server = subprocess.Popen([sys.executable, server_path, '4'], cwd=server_directory,
+                                      stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                # a probing connection would join the lobby, so just wait for the port to be bound
+                time.sleep(0.5)
+                random.seed(BENCHMARK_SEED + game_index)
+                agents = [GeneticAgent.from_json_encoded({'name': f'id{i}', 'rules': encoded_genome['rules']})
+                          for i in range(4)]
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    Population.evaluate_agents(agents)
+                elapsed += time.perf_counter() - start
+            finally:
+                server.wait(timeout=10)
+    return {'games_per_second': BENCHMARK_GAMES / elapsed}
+
+
+def run_benchmarks(include_server: bool = True) -> dict:
+    best_agent = load_best_agent()
+    random.seed(BENCHMARK_SEED)
+    genomes = random_genomes(BENCHMARK_GAMES)
+    states = record_game_states(best_agent, [BENCHMARK_SEED + i for i in range(BENCHMARK_GAMES)])
+    results = {
+        'engine.satisfy_request': benchmark_engine(),
+        'card_evaluator': benchmark_card_evaluator(states),
+        'choose_action.best_agent': benchmark_choose_action([best_agent] * BENCHMARK_GAMES),
+        'choose_action.random_genomes': benchmark_choose_action(genomes),
+        'choose_action.compiled_best_agent': benchmark_choose_action([best_agent] * BENCHMARK_GAMES, compiled=True),
+        'game_data': benchmark_game_data(states),
+    }
+    if include_server:
+        results['evaluate_agents'] = benchmark_evaluate_agents(best_agent)
+    return {
+        'python': platform.python_version(),
+        'seed': BENCHMARK_SEED,
+        'results': {name: {metric: float(f'{value:.4g}') for metric, value in metrics.items()}
+                    for name, metrics in results.items()},
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = BENCHMARK_TOLERANCE) -> List[str]:
+    """ Prints every metric against the baseline and returns the ones that got worse by more than tolerance. """
+    regressions = []
+    for name, metrics in results['results'].items():
+        for metric, value in metrics.items():
+            baseline_value = baseline['results'].get(name, {}).get(metric)
+            if baseline_value is None:
+                print(f"{name}.{metric}: {value} (no baseline)")
+                continue
+            change = (value - baseline_value) / baseline_value
+            worse = -change if metric.endswith(HIGHER_IS_BETTER_SUFFIXES) else change
+            is_regression = worse > tolerance
+            print(f"{name}.{metric}: {baseline_value} -> {value} ({change:+.1%})"
+                  f"{' REGRESSION' if is_regression else ''}")
+            if is_regression:
+                regressions.append(f'{name}.{metric}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks engine, agents and evaluation throughput.")
+    parser.add_argument('--output', default=BENCHMARK_RESULTS_FILE)
+    parser.add_argument('--baseline', default=BENCHMARK_BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--no-server', action='store_true', help="skip the end to end games through server.py")
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(include_server=not arguments.no_server)
+    with open(arguments.output, 'w') as f:
+        json.dump(benchmark_results, f, indent=2, sort_keys=True)
+    if arguments.update_baseline:
+        with open(arguments.baseline, 'w') as f:
+            json.dump(benchmark_results, f, indent=2, sort_keys=True)
+    elif os.path.exists(arguments.baseline):
+        with open(arguments.baseline, 'r') as f:
+            if compare_to_baseline(benchmark_results, json.load(f)):
+                sys.exit(1)
+    else:
+        print(f"No baseline found at {arguments.baseline}, run with --update-baseline to store one.")
@@ -1,4 +1,13 @@
 # Program constants / server constants
 HOST = "127.0.0.1"
 PORT =  1024 # 0x4A7AB1 could have been a better port, but networkers did not allow us to have it
-DATASIZE = int(10240 / 4)
\ No newline at end of file
+DATASIZE = int(10240 / 4)
+
+# Evaluation broker constants
+BROKER_HOST = "127.0.0.1"
+BROKER_PORT = 1025
+BROKER_LEASE_SECONDS = 60
+BROKER_MAX_RETRIES = 3
+BROKER_POLL_INTERVAL = 0.05
+BROKER_JOB_TTL_SECONDS = 3600
+BROKER_EVALUATION_TIMEOUT = 600
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import logging
+import random
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from typing import List, Dict, Optional
+
+from GeneticAgent import GeneticAgent
+from constants import BROKER_HOST, BROKER_PORT, BROKER_LEASE_SECONDS, BROKER_MAX_RETRIES, BROKER_POLL_INTERVAL, \
+    BROKER_JOB_TTL_SECONDS, BROKER_EVALUATION_TIMEOUT
+from game_log import GameLogStore
+from headless_game import play_headless_game
+from instrumentation import METRICS
+
+# Protocol: one JSON object per line, every request is answered with exactly one JSON line.
+#   {"op": "submit", "jobs": [{"genomes": [...], "seed": int}]}         -> {"job_ids": [...]}
+#   {"op": "lease", "worker": str}                                       -> {"job": {...} or null}
+#   {"op": "complete", "job_id": str, "lease_id": str, "result": {...}}  -> {"accepted": bool}
+#   {"op": "fail", "job_id": str, "lease_id": str, "error": str}         -> {"accepted": bool}
+#   {"op": "results", "job_ids": [...]}                                  -> {"results": {job_id: result or null}}
+# A submission may not hold the same (genome set, seed) twice, it is answered with {"error": str}. A job is dropped once
+# its result has been fetched as many times as it was submitted, or BROKER_JOB_TTL_SECONDS after its last submission or
+# after its result arrived, unless a worker holds it. Results are only accepted from the worker holding the current
+# lease of the job.
+
+
+def compute_job_id(genomes: List[dict], seed: int) -> str:
+    """ Identical (genome set, seed) pairs share a job, so their result is computed only once. Names are ignored. """
+    return hashlib.sha1(json.dumps({'genomes': [genome['rules'] for genome in genomes], 'seed': seed},
+                                   sort_keys=True).encode()).hexdigest()
+
+
+class EvaluationBroker:
+    """ Work queue handing out evaluation jobs to workers under time limited leases. """
+
+    def __init__(self, lease_seconds: float = BROKER_LEASE_SECONDS, max_retries: int = BROKER_MAX_RETRIES,
+                 job_ttl_seconds: float = BROKER_JOB_TTL_SECONDS):
+        self.lease_seconds = lease_seconds
+        self.max_retries = max_retries
+        self.job_ttl_seconds = job_ttl_seconds
+        self.jobs: Dict[str, dict] = {}
+        self.pending: deque = deque()
+        self.leased: Dict[str, dict] = {}  # job_id -> lease
+        self.results: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def handle(self, request: dict) -> dict:
+        with self.lock:
+            self.drop_expired_jobs()
+            if request['op'] == 'submit':
+                job_ids = [compute_job_id(job['genomes'], job['seed']) for job in request['jobs']]
+                if len(set(job_ids)) < len(job_ids):
+                    return {'error': "The same (genome set, seed) was submitted twice, submit every job once"}
+                return {'job_ids': [self.submit(job['genomes'], job['seed']) for job in request['jobs']]}
+            elif request['op'] == 'lease':
+                return {'job': self.lease(request.get('worker', ''))}
+            elif request['op'] == 'complete':
+                return {'accepted': self.complete(request['job_id'], request['lease_id'], request['result'])}
+            elif request['op'] == 'fail':
+                return {'accepted': self.fail(request['job_id'], request['lease_id'], request['error'])}
+            elif request['op'] == 'results':
+                return {'results': self.fetch_results(request['job_ids'])}
+            return {'error': f"Unknown operation {request['op']}"}
+
+    def submit(self, genomes: List[dict], seed: int) -> str:
+        job_id = compute_job_id(genomes, seed)
+        if job_id not in self.jobs:
+            self.jobs[job_id] = {'job_id': job_id, 'genomes': genomes, 'seed': seed, 'attempts': 0, 'submissions': 0}
+            self.pending.append(job_id)
+        self.jobs[job_id]['submissions'] += 1
+        self.jobs[job_id]['deadline'] = time.monotonic() + self.job_ttl_seconds
+        return job_id
+
+    def lease(self, worker: str) -> Optional[dict]:
+        self.requeue_expired_leases()
+        while self.pending:
+            job = self.jobs.get(self.pending.popleft())
+            if job is None or job['job_id'] in self.results:
+                continue
+            job['attempts'] += 1
+            lease_id = uuid.uuid4().hex
+            self.leased[job['job_id']] = {'lease_id': lease_id, 'worker': worker,
+                                          'deadline': time.monotonic() + self.lease_seconds}
+            logging.debug(f"Job {job['job_id']} leased to {worker}, attempt {job['attempts']}.")
+            return {'job_id': job['job_id'], 'lease_id': lease_id, 'genomes': job['genomes'], 'seed': job['seed']}
+        return None
+
+    def complete(self, job_id: str, lease_id: str, result: dict) -> bool:
+        lease = self.leased.get(job_id)
+        if lease is None or lease['lease_id'] != lease_id:
+            logging.debug(f"Result for job {job_id} under an expired or unknown lease dropped.")
+            return False
+        self.leased.pop(job_id)
+        self.set_result(job_id, result)
+        return True
+
+    def fail(self, job_id: str, lease_id: str, error: str) -> bool:
+        lease = self.leased.get(job_id)
+        if lease is None or lease['lease_id'] != lease_id:
+            return False
+        logging.warning(f"Job {job_id} failed on {lease['worker']}: {error}")
+        self.retry_or_give_up(job_id, error)
+        return True
+
+    def requeue_expired_leases(self):
+        now = time.monotonic()
+        for job_id, lease in list(self.leased.items()):
+            if lease['deadline'] < now:
+                logging.warning(f"Lease of job {job_id} held by {lease['worker']} expired.")
+                self.retry_or_give_up(job_id, 'lease expired')
+
+    def retry_or_give_up(self, job_id: str, error: str):
+        self.leased.pop(job_id)
+        if self.jobs[job_id]['attempts'] >= self.max_retries:
+            self.set_result(job_id, {'error': error})
+        else:
+            self.pending.append(job_id)
+
+    def set_result(self, job_id: str, result: dict):
+        self.results[job_id] = result
+        self.jobs[job_id]['deadline'] = time.monotonic() + self.job_ttl_seconds
+
+    def fetch_results(self, job_ids: List[str]) -> Dict[str, Optional[dict]]:
+        """ Results of the jobs, None for unfinished ones. A job is dropped once every submission fetched it. """
+        results = {}
+        for job_id in job_ids:
+            if job_id in self.results:
+                results[job_id] = self.results[job_id]
+                self.jobs[job_id]['submissions'] -= 1
+                if self.jobs[job_id]['submissions'] <= 0:
+                    self.drop_job(job_id)
+            elif job_id in self.jobs:
+                results[job_id] = None
+            else:
+                results[job_id] = {'error': 'unknown job, its result was already fetched or expired'}
+        return results
+
+    def drop_expired_jobs(self):
+        """ Drops the jobs past their deadline that no worker holds, finished or still pending. """
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job['deadline'] < now and job_id not in self.leased:
+                if job_id in self.results:
+                    logging.warning(f"Result of job {job_id} was never fetched, dropped.")
+                else:
+                    logging.warning(f"Job {job_id} was never done, dropped.")
+                self.drop_job(job_id)
+
+    def drop_job(self, job_id: str):
+        self.jobs.pop(job_id, None)
+        self.results.pop(job_id, None)
+
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.broker.handle(json.loads(line))
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, broker: EvaluationBroker, host: str = BROKER_HOST, port: int = BROKER_PORT):
+        self.broker = broker
+        super().__init__((host, port), BrokerRequestHandler)
+
+
+class BrokerConnection:
+    """ Blocking line based connection to a broker, used by trainer and workers. """
+
+    def __init__(self, host: str = BROKER_HOST, port: int = BROKER_PORT):
+        self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, message: dict) -> dict:
+        self.file.write((json.dumps(message) + '\n').encode())
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Broker closed the connection.")
+        return json.loads(line)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class BrokerClient:
+    """ Trainer side of the broker: submits (genome set, seed) jobs and waits for their scores. """
+
+    def __init__(self, host: str = BROKER_HOST, port: int = BROKER_PORT, timeout: float = BROKER_EVALUATION_TIMEOUT):
+        self.connection = BrokerConnection(host, port)
+        self.timeout = timeout
+
+    def evaluate(self, genome_sets: List[List[dict]], seeds: List[int]) -> List[dict]:
+        """
+        Results of the games, see run_job. Failed jobs score 0. Raises TimeoutError if some jobs are not done after
+        timeout seconds, e.g. when no worker is alive.
+        """
+        jobs = {}  # identical games are submitted once
+        for genomes, seed in zip(genome_sets, seeds):
+            jobs.setdefault(compute_job_id(genomes, seed), {'genomes': genomes, 'seed': seed})
+        self.connection.request({'op': 'submit', 'jobs': list(jobs.values())})
+        job_ids = [compute_job_id(genomes, seed) for genomes, seed in zip(genome_sets, seeds)]
+        deadline = time.monotonic() + self.timeout
+        results = {}
+        while True:
+            # every submission is fetched once, finished results are not asked again
+            unfinished = [job_id for job_id in jobs if job_id not in results]
+            results.update((job_id, result) for job_id, result in
+                           self.connection.request({'op': 'results', 'job_ids': unfinished})['results'].items()
+                           if result is not None)
+            if len(results) == len(jobs):
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{len(jobs) - len(results)} of {len(jobs)} evaluation jobs "
+                                   f"unfinished after {self.timeout}s, are the broker's workers running?")
+            time.sleep(BROKER_POLL_INTERVAL)
+        for job_id in jobs:
+            if 'error' in results[job_id]:
+                logging.warning(f"Evaluation job {job_id} failed: {results[job_id]['error']}")
+                results[job_id] = {'score': 0}
+        return [results[job_id] for job_id in job_ids]
+
+
+def run_job(job: dict, game_log: Optional[GameLogStore] = None, deck_order: Optional[bytes] = None) -> dict:
+    """ Plays the game of a job. The decisions taken are returned, as the worker's METRICS are not the trainer's. """
+    random.seed(job['seed'])
+    agents = [GeneticAgent.from_json_encoded({'name': f'seat{i}', 'rules': genome['rules']})
+              for i, genome in enumerate(job['genomes'])]
+    decisions_before = METRICS.get_count('decisions')
+    score = play_headless_game(agents, job['seed'], game_log, deck_order)
+    return {'score': score, 'rule_fire_counts': [agent.rule_fire_counts for agent in agents],
+            'decisions': METRICS.get_count('decisions') - decisions_before}
+
+
+def run_worker(host: str = BROKER_HOST, port: int = BROKER_PORT, worker_name: Optional[str] = None,
+               game_log_path: Optional[str] = None):
+    """
+    Stateless worker: pulls jobs from the broker and plays them with the headless engine. SIGTERM and SIGINT stop it
+    after writing the buffered games of the game log.
+    """
+    worker_name = worker_name if worker_name is not None else f'{socket.gethostname()}-{uuid.uuid4().hex[:8]}'
+    game_log = GameLogStore(game_log_path) if game_log_path is not None else None
+    if threading.current_thread() is threading.main_thread():  # signal handlers can only be set there
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, stop_worker)
+    connection = BrokerConnection(host, port)
+    logging.info(f"Worker {worker_name} connected to broker {host}:{port}.")
+    try:
+        while True:
+            job = connection.request({'op': 'lease', 'worker': worker_name})['job']
+            if job is None:
+                time.sleep(BROKER_POLL_INTERVAL)
+                continue
+            try:
+                result = run_job(job, game_log)
+            except Exception:
+                connection.request({'op': 'fail', 'job_id': job['job_id'], 'lease_id': job['lease_id'],
+                                    'error': traceback.format_exc()})
+                continue
+            connection.request({'op': 'complete', 'job_id': job['job_id'], 'lease_id': job['lease_id'],
+                                'result': result})
+    finally:
+        if game_log is not None:
+            game_log.close()
+
+
+def stop_worker(signal_number: int, frame):
+    """ Leaves run_worker through its finally clause. The job being played is not completed, its lease expires. """
+    logging.info(f"Worker stopped by signal {signal_number}.")
+    sys.exit(0)
+
+
+def serve_broker(host: str = BROKER_HOST, port: int = BROKER_PORT):
+    with BrokerServer(EvaluationBroker(), host, port) as server:
+        logging.info(f"Evaluation broker listening on {host}:{port}.")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] not in ('broker', 'worker'):
+        print("Usage: python evaluation_broker.py broker [<IP> <port>]\n"
+              "       python evaluation_broker.py worker [<IP> <port> [<game log directory>]]")
+        sys.exit(1)
+    address = (sys.argv[2], int(sys.argv[3])) if len(sys.argv) > 3 else (BROKER_HOST, BROKER_PORT)
+    if sys.argv[1] == 'broker':
+        serve_broker(*address)
+    else:
+        run_worker(*address, game_log_path=sys.argv[4] if len(sys.argv) > 4 else None)
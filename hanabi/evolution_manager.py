@@ -1,17 +1,25 @@
+import argparse
 import json
+import logging
 import random
 import socket
 import statistics
-from threading import Thread
-from typing import List, Dict, Tuple
+import sys
+from typing import List, Dict, Tuple, Optional
 
 from Agent import Agent
 from DiscardRule import DiscardRule
 from GeneticAgent import GeneticAgent
 from HintRule import HintRule
 from PlayRule import PlayRule
-from SocketAgent import SocketAgent
-from user_constants import CHOOSE_STRONG_PARENT_PROB, SAVE_RESULTS_AFTER_EPOCHS
+from SocketAgent import SocketAgent, SocketSession
+from evaluation_broker import BrokerClient
+from instrumentation import METRICS
+from SurrogateModel import SurrogateModel, rank_correlation
+from user_constants import CHOOSE_STRONG_PARENT_PROB, SAVE_RESULTS_AFTER_EPOCHS, SURROGATE_NUM_CANDIDATES, \
+    METRICS_STREAM_FILE, DEAL_CORPUS_SIZE, SURROGATE_CHECKPOINT_PATTERN, SURROGATE_CONTROL_PROB
+
+SURROGATE_ACCURACY_WINDOW = 50
 
 
 def get_seeded_starting_agent(name: str):
@@ -23,6 +31,16 @@ def get_seeded_starting_agent(name: str):
     ])
 
 
+def load_surrogate(checkpoint_pattern: Optional[str] = SURROGATE_CHECKPOINT_PATTERN) -> SurrogateModel:
+    """ Surrogate model warm started with the genomes of the checkpoints matching checkpoint_pattern, if not None. """
+    surrogate = SurrogateModel()
+    if checkpoint_pattern is not None:
+        num_samples = surrogate.load_checkpoints(checkpoint_pattern)
+        surrogate.fit()
+        logging.info(f"Surrogate loaded {num_samples} distinct genomes from {checkpoint_pattern}.")
+    return surrogate
+
+
 class AgentScore:
     def __init__(self, agent: GeneticAgent, score: int):
         self.agent = agent
@@ -30,17 +48,39 @@ class AgentScore:
 
 
 class Population:
-    def __init__(self, agent_scores: List[AgentScore]):
+    def __init__(self, agent_scores: List[AgentScore], surrogate: Optional[SurrogateModel] = None,
+                 broker: Optional[BrokerClient] = None, session: Optional[SocketSession] = None):
         self.agent_scores = agent_scores
         self.id_counter: int = 0
+        self.surrogate = surrogate
+        self.broker = broker
+        self.session = session
+        self.surrogate_predictions: List[Tuple[float, float]] = []  # (predicted, actual) for evaluated offspring
+        self.control_scores: List[int] = []  # of the last offspring bred without the prescreen once it is ready
 
-    def train(self, n_epochs: int):
+    def train(self, n_epochs: int, metrics_path: Optional[str] = METRICS_STREAM_FILE,
+              profile_epoch: Optional[int] = None):
+        """
+        Runs n_epochs of steady state evolution. Per-epoch timings and throughput are appended to metrics_path as
+        JSON lines, and the epoch profile_epoch is profiled and dumped to profile_epoch_<n>.prof.
+        """
         for i in range(n_epochs):
-            self.kill_random_agent()
-            self.add_offspring()
-            if i%SAVE_RESULTS_AFTER_EPOCHS == 0:
-                with open(f'training_{i}.json', 'w') as f:
-                    json.dump(self.to_json_encoded(), f)
+            METRICS.start_epoch()
+            if i == profile_epoch:
+                METRICS.start_profile()
+            with METRICS.span('epoch'):
+                self.kill_random_agent()
+                with METRICS.span('add_offspring'):
+                    self.add_offspring()
+                if self.surrogate is not None:
+                    self.surrogate.fit()
+                    self.log_surrogate_statistics(i)
+                if i%SAVE_RESULTS_AFTER_EPOCHS == 0:
+                    with METRICS.span('checkpoint'), open(f'training_{i}.json', 'w') as f:
+                        json.dump(self.to_json_encoded(), f)
+            if i == profile_epoch:
+                METRICS.dump_profile(f'profile_epoch_{i}.prof')
+            METRICS.end_epoch(i, metrics_path)
 
     def compute_median_score(self) -> float:
         return statistics.median([agent.score for agent in self.agent_scores])
@@ -67,53 +107,154 @@ class Population:
         else:
             return self.agent_scores[random.choice(worse_agents)]
 
-    def add_offspring(self):
-        offspring = self.choose_parent().agent.crossover(f'id{self.id_counter}', self.choose_parent())
+    def breed_offspring(self) -> GeneticAgent:
+        offspring = self.choose_parent().agent.crossover(f'id{self.id_counter}', self.choose_parent().agent)
         self.id_counter += 1
         offspring.mutate()
-        players = random.sample(self.agent_scores, 3) + offspring
-        self.agent_scores.append(offspring)
-        new_scores = Population.evaluate_agents([agent.agent for agent in players])
+        return offspring
+
+    def prescreen_offspring(self) -> Tuple[GeneticAgent, float]:
+        """ Breeds several candidates and keeps the one the surrogate expects to score best. """
+        candidates = [self.breed_offspring() for _ in range(SURROGATE_NUM_CANDIDATES)]
+        predictions = [self.surrogate.predict(candidate.to_json_encoded()) for candidate in candidates]
+        best_index = max(range(len(candidates)), key=lambda i: predictions[i])
+        return candidates[best_index], predictions[best_index]
+
+    def add_offspring(self):
+        control = self.surrogate is not None and self.surrogate.is_ready() and random.random() < SURROGATE_CONTROL_PROB
+        if self.surrogate is not None and self.surrogate.is_ready() and not control:
+            offspring, predicted_score = self.prescreen_offspring()
+        else:
+            offspring, predicted_score = self.breed_offspring(), None
+        offspring_score = AgentScore(offspring, 0)
+        players = random.sample(self.agent_scores, 3) + [offspring_score]
+        self.agent_scores.append(offspring_score)
+        new_scores = self.evaluate_groups([[agent.agent for agent in players]])[0]
         for i in range(len(players)):
             players[i].score = new_scores[i].score
+        if self.surrogate is not None:
+            for player in players:
+                self.surrogate.add_sample(player.agent.to_json_encoded(), player.score)
+            if predicted_score is not None:
+                self.surrogate_predictions.append((predicted_score, offspring_score.score))
+                self.surrogate_predictions = self.surrogate_predictions[-SURROGATE_ACCURACY_WINDOW:]
+            if control:
+                self.control_scores.append(offspring_score.score)
+                self.control_scores = self.control_scores[-SURROGATE_ACCURACY_WINDOW:]
+
+    def log_surrogate_statistics(self, epoch: int):
+        if len(self.surrogate_predictions) == 0:
+            logging.info(f"Epoch {epoch}: surrogate not ready, {self.surrogate.num_samples} samples collected.")
+            return
+        predicted = [prediction for prediction, _ in self.surrogate_predictions]
+        actual = [score for _, score in self.surrogate_predictions]
+        mean_absolute_error = statistics.mean(abs(p - a) for p, a in self.surrogate_predictions)
+        if self.control_scores:
+            control = f"{statistics.mean(self.control_scores):.2f} for the last {len(self.control_scores)} " \
+                      f"offspring bred without prescreen"
+        else:
+            control = "no offspring bred without prescreen yet"
+        logging.info(f"Epoch {epoch}: surrogate MAE {mean_absolute_error:.2f}, "
+                     f"rank correlation {rank_correlation(predicted, actual):.2f}, "
+                     f"mean score {statistics.mean(actual):.2f} over the last {len(self.surrogate_predictions)} "
+                     f"prescreened offspring, {control}.")
 
     def reevaluate_all(self):
-        for i in range(0, len(self.agent_scores), 4):
-            results = Population.evaluate_agents([agent.agent for agent in self.agent_scores[i:i+4]])
-            for j in range(4):
-                self.agent_scores[i+j].score = results[j].score
+        groups = [self.agent_scores[i:i+4] for i in range(0, len(self.agent_scores), 4)]
+        results = self.evaluate_groups([[agent.agent for agent in group] for group in groups])
+        for group, group_results in zip(groups, results):
+            for j in range(len(group)):
+                group[j].score = group_results[j].score
+
+    def evaluate_groups(self, groups: List[List[GeneticAgent]]) -> List[List[AgentScore]]:
+        """
+        Plays one game per group, on the broker's workers if one is configured, else through the server, over the
+        connections of the session if there is one and the groups fill its seats.
+        """
+        if self.broker is None:
+            if self.session is not None and all(len(agents) == len(self.session.seat_names) for agents in groups):
+                return self.evaluate_in_session(groups)
+            return [Population.evaluate_agents(agents) for agents in groups]
+        with METRICS.span('broker_evaluation'):
+            results = self.broker.evaluate([[agent.to_json_encoded() for agent in agents] for agents in groups],
+                                           [random.randrange(DEAL_CORPUS_SIZE) for _ in groups])
+        METRICS.count('games', len(groups))
+        METRICS.count('decisions', sum(result.get('decisions', 0) for result in results))
+        for agents, result in zip(groups, results):
+            for agent, rule_fire_counts in zip(agents, result.get('rule_fire_counts', [])):
+                agent.add_rule_fire_counts(rule_fire_counts)
+        return [[AgentScore(agent, result['score']) for agent in agents] for agents, result in zip(groups, results)]
+
+    def evaluate_in_session(self, groups: List[List[GeneticAgent]]) -> List[List[AgentScore]]:
+        """ Every agent plays through a copy named after its seat, whose rule fire counts are added back. """
+        seat_names = self.session.seat_names
+        seat_groups = [[GeneticAgent(seat_name, agent.rules) for seat_name, agent in zip(seat_names, agents)]
+                       for agents in groups]
+        with METRICS.span('session_evaluation'):
+            scores = self.session.play_games(seat_groups, [random.randrange(DEAL_CORPUS_SIZE) for _ in groups])
+        METRICS.count('games', len(groups))
+        for agents, seat_agents in zip(groups, seat_groups):
+            for agent, seat_agent in zip(agents, seat_agents):
+                agent.add_rule_fire_counts(seat_agent.rule_fire_counts)
+        return [[AgentScore(agent, score) for agent in agents] for agents, score in zip(groups, scores)]
 
     def to_json_encoded(self):
         return {
-            'id': self.id_counter, 'agents': [agent.agent.to_json_encoded() for agent in self.agent_scores]
+            'id': self.id_counter, 'agents': [agent.agent.to_json_encoded() for agent in self.agent_scores],
+            'scores': [agent.score for agent in self.agent_scores]
         }
 
     @staticmethod
-    def from_json_encoded(encoded_object: dict):
+    def from_json_encoded(encoded_object: dict, surrogate: Optional[SurrogateModel] = None,
+                          broker: Optional[BrokerClient] = None, session: Optional[SocketSession] = None):
         population = Population([AgentScore(GeneticAgent.from_json_encoded(agent), 0)
-                                 for agent in encoded_object['agents']])
+                                 for agent in encoded_object['agents']], surrogate, broker, session)
         population.id_counter = encoded_object['id']
         population.reevaluate_all()
         return population
 
     @staticmethod
-    def initialize_seeded(num_individuals):
+    def initialize_seeded(num_individuals, surrogate: Optional[SurrogateModel] = None,
+                          broker: Optional[BrokerClient] = None, session: Optional[SocketSession] = None):
         agents = [get_seeded_starting_agent(f'id{agent_id}') for agent_id in range(num_individuals)]
         for agent in agents:
             agent.mutate()
-        result = Population([AgentScore(agent, 0) for agent in agents])
+        result = Population([AgentScore(agent, 0) for agent in agents], surrogate, broker, session)
         result.id_counter = num_individuals + 1
         result.reevaluate_all()
         return result
 
     @staticmethod
     def evaluate_agents(agents: List[GeneticAgent]) -> List[AgentScore]:
-        socket_agents = [SocketAgent(socket.socket(socket.AF_INET, socket.SOCK_STREAM), agent) for agent in agents]
-        threads = [Thread(target=agent.play_game) for agent in socket_agents]
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-        for agent in socket_agents:
-            agent.socket.close()
-        return [AgentScore(agent.agent, agent.score) for agent in socket_agents]
+        """ Plays a game through the server, with every agent sitting at one connection, see SocketAgent.join_table. """
+        with METRICS.span('evaluate_agents'):
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as table_socket:
+                table = SocketAgent(table_socket, agents[0], agents[1:])
+                table.play_table_game(len(agents))
+        METRICS.count('games')
+        return [AgentScore(agent, table.score) for agent in agents]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Evolves a population of GeneticAgents.")
+    parser.add_argument('--epochs', type=int, default=1000)
+    parser.add_argument('--individuals', type=int, default=40, help="size of a new population")
+    parser.add_argument('--resume', help="checkpoint to start from, e.g. training_100.json")
+    parser.add_argument('--surrogate', action='store_true', help="prescreen offspring with a surrogate model")
+    parser.add_argument('--surrogate-checkpoints', default=SURROGATE_CHECKPOINT_PATTERN,
+                        help="checkpoints the surrogate learns from before training, '' for none")
+    parser.add_argument('--broker', help="<IP>:<port> of an evaluation broker, see evaluation_broker.py")
+    arguments = parser.parse_args()
+
+    population_surrogate = load_surrogate(arguments.surrogate_checkpoints or None) if arguments.surrogate else None
+    population_broker = None
+    if arguments.broker is not None:
+        broker_host, broker_port = arguments.broker.split(':')
+        population_broker = BrokerClient(broker_host, int(broker_port))
+    if arguments.resume is not None:
+        with open(arguments.resume, 'r') as f:
+            population = Population.from_json_encoded(json.load(f), population_surrogate, population_broker)
+    else:
+        population = Population.initialize_seeded(arguments.individuals, population_surrogate, population_broker)
+    population.train(arguments.epochs)
@@ -1,5 +1,5 @@
 from copy import deepcopy
-from random import shuffle
+from random import shuffle, Random
 import GameData
 import logging
 
@@ -166,7 +166,12 @@ class Game(object):
 
         # score
         self.__score = 0
+        # ! ADDED views of the game state per player, built once per state version, see __satisfyShowCardRequest
+        self.__stateVersion = 0
+        self.__views = {}
         # add actions for each class of data
+        # ! BUGFIX per instance, a class level dict makes concurrent games dispatch to the last created one
+        self.__dataActions = {}
         self.__dataActions[GameData.ClientPlayerDiscardCardRequest] = self.__satisfyDiscardRequest
         self.__dataActions[GameData.ClientGetGameStateRequest] = self.__satisfyShowCardRequest
         self.__dataActions[GameData.ClientPlayerPlayCardRequest] = self.__satisfyPlayCardRequest
@@ -180,6 +185,8 @@ class Game(object):
         if type(data) in self.__dataActions:
             if type(data) == GameData.ClientGetGameStateRequest:
                 data.sender = playerName
+            if type(data) != GameData.ClientGetGameStateRequest:
+                self.__stateVersion += 1
             result = self.__dataActions[type(data)](data)
             if type(data) != GameData.ClientGetGameStateRequest:
                 if len(self.__cardsToDraw) == 0:
@@ -220,10 +227,15 @@ class Game(object):
             return (GameData.ServerActionInvalid("It is not your turn yet"), None)
 
     # Show request
+    # ! ADDED repeated requests of a player get the same view until the state changes, so it is built and serialized once
     def __satisfyShowCardRequest(self, data: GameData.ClientGetGameStateRequest):
         logging.info("Showing hand to: " + data.sender)
-        currentPlayer, playerList, playerHandSize = self.__getPlayersStatus(data.sender)
-        return (GameData.ServerGameStateData(currentPlayer, playerHandSize, playerList, self.__noteTokens, self.__stormTokens, self.__tableCards, self.__discardPile), None)
+        version, view = self.__views.get(data.sender, (None, None))
+        if version != self.__stateVersion:
+            currentPlayer, playerList, playerHandSize = self.__getPlayersStatus(data.sender)
+            view = GameData.ServerGameStateData(currentPlayer, playerHandSize, playerList, self.__noteTokens, self.__stormTokens, self.__tableCards, self.__discardPile)
+            self.__views[data.sender] = (self.__stateVersion, view)
+        return (view, None)
 
     # Play card request
 
@@ -304,8 +316,10 @@ class Game(object):
     # players list. Not the best, but there are literally max 5 players and the list should give us the order of connection = the order of the rounds
     def addPlayer(self, name: str):
         self.__players.append(Player(name))
+        self.__stateVersion += 1
 
     def removePlayer(self, name: str):
+        self.__stateVersion += 1
         for p in self.__players:
             if p.name == name:
                 self.__players.remove(p)
@@ -328,9 +342,17 @@ class Game(object):
         self.__currentPlayer += 1
         self.__currentPlayer %= len(self.__players)
 
-    def start(self):
+    # ! ADDED optional seed so that deals can be reproduced
+    # ! ADDED optional precomputed deck order, the card at position i is the card at deckOrder[i] before shuffling
+    def start(self, seed=None, deckOrder=None):
+        self.__stateVersion += 1
         self.__lastMoves = len(self.__players) + 1
-        shuffle(self.__cardsToDraw)
+        if deckOrder is not None:
+            self.__cardsToDraw = [self.__cardsToDraw[i] for i in deckOrder]
+        elif seed is None:
+            shuffle(self.__cardsToDraw)
+        else:
+            Random(seed).shuffle(self.__cardsToDraw)
         if len(self.__players) < 2:
             logging.warning("Not enough players!")
             return
@@ -345,6 +367,23 @@ class Game(object):
                     p.takeCard(self.__cardsToDraw)
         self.__started = True
 
+    # ! ADDED so that search agents can continue a game from a sampled deal. Players have to be added first.
+    # lastMoves is the number of moves left once the deck is empty, see satisfyRequest
+    def loadState(self, hands: dict, tableCards: dict, discardPile: list, cardsToDraw: list, noteTokens: int,
+                  stormTokens: int, currentPlayerName: str, lastMoves: int = None):
+        self.__stateVersion += 1
+        for p in self.__players:
+            p.hand = list(hands[p.name])
+        self.__tableCards = {color: list(pile) for color, pile in tableCards.items()}
+        self.__discardPile = list(discardPile)
+        self.__cardsToDraw = list(cardsToDraw)
+        self.__noteTokens = noteTokens
+        self.__stormTokens = stormTokens
+        self.__currentPlayer = [p.name for p in self.__players].index(currentPlayerName)
+        self.__lastTurn = len(self.__cardsToDraw) == 0
+        self.__lastMoves = len(self.__players) + 1 if lastMoves is None else lastMoves
+        self.__started = True
+
     def __getPlayersStatus(self, currentPlayerName):
         players = []
         handSize = 0
@@ -441,3 +480,6 @@ class Game(object):
 
     def getScore(self):
         return self.__score
+
+    def getCurrentPlayerName(self) -> str:
+        return self.__getCurrentPlayer().name
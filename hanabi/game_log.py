@@ -0,0 +1,266 @@
+import bisect
+import json
+import mmap
+import os
+import time
+import uuid
+from array import array
+from typing import List, Optional, Tuple, Dict, Iterator
+
+import GameData
+from game import Game
+from user_constants import Color, GAME_LOG_CHUNK_ROWS, GAME_LOG_CHUNK_GAMES, GAME_LOG_FLUSH_SECONDS
+
+# A store is a directory of self-contained chunks. Every chunk directory holds one raw native-endian file per column
+# (<table>.<column>.bin, readable with array.fromfile, mmap or numpy.memmap) and genomes.json, the genome hashes that
+# the genome column indexes. Games are identified by (chunk name, game index in the chunk).
+# Every chunk also holds an index (index.<column>.bin, see INDEX_COLUMNS) of its games by genome and by seed.
+TURN_COLUMNS = [
+    ('game', 'I'),  # index of the game in the chunk
+    ('turn', 'H'),
+    ('seat', 'B'),
+    ('action', 'B'),  # see ACTION_*
+    ('slot', 'B'),  # hand index of the played or discarded card
+    ('card', 'B'),  # card type, color index * 5 + value - 1
+    ('target', 'B'),  # seat the hint was given to
+    ('hint', 'B'),  # color index for color hints, 5 + value - 1 for value hints
+    ('note_tokens', 'B'),  # used note tokens after the turn
+    ('storm_tokens', 'B'),  # storm tokens after the turn
+    ('score', 'B'),  # cards on the table after the turn
+]
+GAME_COLUMNS = [
+    ('seed', 'q'),  # -1 if the deal was not seeded
+    ('score', 'B'),  # final score
+    ('first_row', 'I'),
+    ('num_turns', 'H'),
+]
+SEAT_COLUMNS = [
+    ('game', 'I'),
+    ('seat', 'B'),
+    ('genome', 'I'),  # index into genomes.json
+]
+TABLES = {'turns': TURN_COLUMNS, 'games': GAME_COLUMNS, 'seats': SEAT_COLUMNS}
+INDEX_COLUMNS = [
+    ('genome_offsets', 'I'),  # games of genome i are genome_games[genome_offsets[i]:genome_offsets[i + 1]]
+    ('genome_games', 'I'),  # sorted game indices, grouped by genome
+    ('seed_keys', 'q'),  # seeds of the games, sorted
+    ('seed_games', 'I'),  # the game of each seed_keys entry
+]
+
+ACTION_PLAY = 0
+ACTION_MISPLAY = 1
+ACTION_DISCARD = 2
+ACTION_HINT = 3
+NONE = 255  # in the byte columns
+
+COLOR_NAMES = [color.value for color in Color]
+MAX_NOTE_TOKENS = 8
+
+
+def card_code(card) -> int:
+    return COLOR_NAMES.index(card.color) * 5 + card.value - 1
+
+
+def hint_code(hint: GameData.ClientHintData) -> int:
+    return COLOR_NAMES.index(hint.value) if hint.type in ('color', 'colour') else 5 + hint.value - 1
+
+
+class GameLogStore:
+    """
+    Buffers the turns of finished games and writes them as a new chunk every chunk_rows turns, chunk_games games or
+    flush_seconds seconds, whichever comes first, and on close.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = GAME_LOG_CHUNK_ROWS, chunk_games: int = GAME_LOG_CHUNK_GAMES,
+                 flush_seconds: float = GAME_LOG_FLUSH_SECONDS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.chunk_games = chunk_games
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.monotonic()
+        # several writers (e.g. broker workers) can share a store, chunk names start with a writer id
+        self.writer_id = uuid.uuid4().hex[:8]
+        self.num_chunks = 0
+        os.makedirs(path, exist_ok=True)
+        self.reset_buffers()
+
+    def reset_buffers(self):
+        self.columns = {table: {name: array(typecode) for name, typecode in columns}
+                        for table, columns in TABLES.items()}
+        self.genome_ids: Dict[str, int] = {}
+
+    def wrap(self, game: Game, seed: Optional[int], genome_hashes: List[str]):
+        """ Logger to use in place of the started game, the game is added to the store when it is over. """
+        return GameLogger(self, game, seed, genome_hashes)
+
+    def add_game(self, seed: Optional[int], score: int, genome_hashes: List[str], rows: List[tuple]):
+        game_index = len(self.columns['games']['seed'])
+        games = self.columns['games']
+        games['seed'].append(-1 if seed is None else seed)
+        games['score'].append(score)
+        games['first_row'].append(len(self.columns['turns']['game']))
+        games['num_turns'].append(len(rows))
+        for seat, genome_hash in enumerate(genome_hashes):
+            self.columns['seats']['game'].append(game_index)
+            self.columns['seats']['seat'].append(seat)
+            self.columns['seats']['genome'].append(self.genome_ids.setdefault(genome_hash, len(self.genome_ids)))
+        turn_columns = [self.columns['turns'][name] for name, _ in TURN_COLUMNS]
+        for row in rows:
+            for column, value in zip(turn_columns, (game_index,) + row):
+                column.append(value)
+        if len(self.columns['turns']['game']) >= self.chunk_rows or game_index + 1 >= self.chunk_games \
+                or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if len(self.columns['games']['seed']) == 0:
+            return
+        chunk_path = os.path.join(self.path, f'{self.writer_id}_{self.num_chunks:06d}')
+        os.makedirs(chunk_path)
+        for table, columns in self.columns.items():
+            for name, column in columns.items():
+                with open(os.path.join(chunk_path, f'{table}.{name}.bin'), 'wb') as f:
+                    column.tofile(f)
+        write_index(chunk_path, self.columns['games']['seed'], self.columns['seats']['game'],
+                    self.columns['seats']['genome'], len(self.genome_ids))
+        # written last, chunks without genomes.json are incomplete and skipped by readers
+        with open(os.path.join(chunk_path, 'genomes.json'), 'w') as f:
+            json.dump(sorted(self.genome_ids, key=self.genome_ids.get), f)
+        self.num_chunks += 1
+        self.reset_buffers()
+
+    def close(self):
+        self.flush()
+
+
+class GameLogger:
+    """ Wraps a started game.Game like replay.GameRecorder, and turns every valid action into a row of TURN_COLUMNS. """
+
+    def __init__(self, store: GameLogStore, game: Game, seed: Optional[int], genome_hashes: List[str]):
+        self.store = store
+        self.game = game
+        self.seed = seed
+        self.genome_hashes = genome_hashes
+        self.seats = {player.name: seat for seat, player in enumerate(game.getPlayers())}
+        self.pile_heights = {color: 0 for color in COLOR_NAMES}
+        self.note_tokens = 0
+        self.storm_tokens = 0
+        self.rows: List[tuple] = []
+
+    def getCurrentPlayerName(self) -> str:
+        return self.game.getCurrentPlayerName()
+
+    def satisfyRequest(self, data: GameData.ClientToServerData, playerName: str):
+        if type(data) is GameData.ClientGetGameStateRequest:
+            return self.game.satisfyRequest(data, playerName)
+        card = None
+        if type(data) in (GameData.ClientPlayerPlayCardRequest, GameData.ClientPlayerDiscardCardRequest):
+            hand = self.game.getPlayers()[self.seats[playerName]].hand
+            if 0 <= data.handCardOrdered < len(hand):
+                card = hand[data.handCardOrdered]
+        single_data, multiple_data = self.game.satisfyRequest(data, playerName)
+        if single_data is None:
+            self.log_turn(data, self.seats[playerName], card)
+            if type(multiple_data) is GameData.ServerGameOver:
+                self.store.add_game(self.seed, multiple_data.score, self.genome_hashes, self.rows)
+        return single_data, multiple_data
+
+    def log_turn(self, data: GameData.ClientToServerData, seat: int, card):
+        """ Follows the rules of game.Game, so that the last turn is logged although its result is ServerGameOver. """
+        slot = target = hint = NONE
+        if type(data) is GameData.ClientHintData:
+            action = ACTION_HINT
+            target = self.seats[data.destination]
+            hint = hint_code(data)
+            self.note_tokens += 1
+        elif type(data) is GameData.ClientPlayerDiscardCardRequest:
+            action = ACTION_DISCARD
+            slot = data.handCardOrdered
+            self.note_tokens -= 1
+        elif card.value == self.pile_heights[card.color] + 1:
+            action = ACTION_PLAY
+            slot = data.handCardOrdered
+            self.pile_heights[card.color] += 1
+            if card.value == 5 and self.note_tokens > 0:
+                self.note_tokens -= 1
+        else:
+            action = ACTION_MISPLAY
+            slot = data.handCardOrdered
+            self.storm_tokens += 1
+        self.rows.append((len(self.rows), seat, action, slot, NONE if card is None else card_code(card), target, hint,
+                          self.note_tokens, self.storm_tokens, sum(self.pile_heights.values())))
+
+
+def write_index(chunk_path: str, seeds, seat_games, seat_genomes, num_genomes: int):
+    """ Writes the INDEX_COLUMNS of a chunk from its games.seed, seats.game and seats.genome columns. """
+    games_by_genome = [set() for _ in range(num_genomes)]
+    for game, genome in zip(seat_games, seat_genomes):
+        games_by_genome[genome].add(game)
+    seed_games = sorted(range(len(seeds)), key=lambda game: seeds[game])
+    index = {'genome_offsets': [0], 'genome_games': [], 'seed_keys': [seeds[game] for game in seed_games],
+             'seed_games': seed_games}
+    for games in games_by_genome:
+        index['genome_games'] += sorted(games)
+        index['genome_offsets'].append(len(index['genome_games']))
+    for name, typecode in INDEX_COLUMNS:
+        with open(os.path.join(chunk_path, f'index.{name}.bin'), 'wb') as f:
+            array(typecode, index[name]).tofile(f)
+
+
+def list_chunks(path: str) -> List[str]:
+    """ Complete chunks of the store at path. """
+    return sorted(name for name in os.listdir(path) if os.path.exists(os.path.join(path, name, 'genomes.json')))
+
+
+def map_column(path: str, chunk: str, table: str, name: str) -> memoryview:
+    """ Zero copy view of a column, the file stays mapped while the view is alive. """
+    typecode = dict(INDEX_COLUMNS if table == 'index' else TABLES[table])[name]
+    with open(os.path.join(path, chunk, f'{table}.{name}.bin'), 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array(typecode))
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+
+def load_genomes(path: str, chunk: str) -> List[str]:
+    with open(os.path.join(path, chunk, 'genomes.json'), 'r') as f:
+        return json.load(f)
+
+
+def find_games(path: str, genome_hash: Optional[str] = None, seed: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    (chunk, game index) of the games played by genome_hash (in any seat) with the deal seed, if given. Uses the index
+    of every chunk, only the matching entries are read.
+    """
+    games = []
+    for chunk in list_chunks(path):
+        candidates = None
+        if genome_hash is not None:
+            genomes = load_genomes(path, chunk)
+            if genome_hash not in genomes:
+                continue
+            genome_id = genomes.index(genome_hash)
+            offsets = map_column(path, chunk, 'index', 'genome_offsets')
+            candidates = map_column(path, chunk, 'index', 'genome_games')[offsets[genome_id]:offsets[genome_id + 1]]
+        if seed is not None:
+            seed_keys = map_column(path, chunk, 'index', 'seed_keys')
+            seed_games = map_column(path, chunk, 'index', 'seed_games')[bisect.bisect_left(seed_keys, seed):
+                                                                        bisect.bisect_right(seed_keys, seed)]
+            candidates = sorted(seed_games) if candidates is None else sorted(set(candidates) & set(seed_games))
+        if candidates is None:
+            candidates = range(len(map_column(path, chunk, 'games', 'seed')))
+        games += [(chunk, game) for game in candidates]
+    return games
+
+
+def read_game_turns(path: str, chunk: str, game: int) -> List[Dict[str, int]]:
+    first_row = map_column(path, chunk, 'games', 'first_row')[game]
+    num_turns = map_column(path, chunk, 'games', 'num_turns')[game]
+    columns = {name: map_column(path, chunk, 'turns', name) for name, _ in TURN_COLUMNS}
+    return [{name: column[row] for name, column in columns.items()} for row in range(first_row, first_row + num_turns)]
+
+
+def iter_column(path: str, table: str, name: str) -> Iterator[memoryview]:
+    """ The column of every chunk, for aggregations over the whole store without loading it. """
+    for chunk in list_chunks(path):
+        yield map_column(path, chunk, table, name)
@@ -0,0 +1,61 @@
+import logging
+from typing import List, Optional
+
+import GameData
+from Agent import Agent
+from game import Game
+
+
+def action_key(action: GameData.ClientToServerData) -> tuple:
+    """ Equal for actions that have the same effect, whoever sent them. """
+    if type(action) is GameData.ClientHintData:
+        return type(action), action.destination, action.type, action.value
+    return type(action), action.handCardOrdered
+
+
+def notify_action_performed(agents: List[Agent], action: GameData.ServerToClientData):
+    """ Forwards a broadcast to the agents, like SocketAgent.handle_action_performed does. """
+    for agent in agents:
+        if type(action) in (GameData.ServerPlayerMoveOk, GameData.ServerPlayerThunderStrike,
+                            GameData.ServerActionValid):
+            agent.register_card_play(action)
+        elif type(action) is GameData.ServerHintData:
+            agent.register_hint(action)
+
+
+def play_headless_game(agents: List[Agent], seed: Optional[int] = None, game_log=None,
+                       deck_order: Optional[bytes] = None) -> int:
+    """
+    Plays a whole game in-process, without server and sockets, and returns the final score. The turns are added to
+    game_log (a game_log.GameLogStore) if given, with the genome hash of the agents that have one. deck_order is the
+    shuffle of seed if it was precomputed, see Game.start.
+    """
+    if len(agents) < 2:
+        raise ValueError("A game needs at least 2 players.")
+    game = Game()
+    for agent in agents:
+        game.addPlayer(agent.name)
+    game.start(seed, deck_order)
+    if game_log is not None:
+        game = game_log.wrap(game, seed, [agent.genome_hash() if hasattr(agent, 'genome_hash') else ''
+                                          for agent in agents])
+    for agent in agents:
+        agent.update_game_state(game.satisfyRequest(GameData.ClientGetGameStateRequest(agent.name), agent.name)[0])
+    return play_until_game_over(game, agents)
+
+
+def play_until_game_over(game: Game, agents: List[Agent]) -> int:
+    """ Lets the agents take their turns in a started game until it is over, returns the final score. """
+    agents_by_name = {agent.name: agent for agent in agents}
+    while True:
+        current_agent = agents_by_name[game.getCurrentPlayerName()]
+        state, _ = game.satisfyRequest(GameData.ClientGetGameStateRequest(current_agent.name), current_agent.name)
+        current_agent.update_game_state(state)
+        single_data, multiple_data = game.satisfyRequest(current_agent.choose_action(), current_agent.name)
+        if single_data is not None:
+            logging.warning(f"Headless game aborted, {current_agent.name} performed an invalid action: "
+                            f"{getattr(single_data, 'message', getattr(single_data, 'data', None))}")
+            return 0
+        if type(multiple_data) is GameData.ServerGameOver:
+            return multiple_data.score
+        notify_action_performed(agents, multiple_data)
@@ -0,0 +1,80 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class Metrics:
+    """
+    Thread safe collector of wall-time spans and counters for the training loop.
+    Spans of concurrent threads are summed, so they can exceed the wall time of the epoch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.span_totals: Dict[str, float] = {}
+        self.span_counts: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.epoch_start = time.perf_counter()
+        self.profiler: Optional[cProfile.Profile] = None
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.span_totals[name] = self.span_totals.get(name, 0.) + elapsed
+                self.span_counts[name] = self.span_counts.get(name, 0) + 1
+
+    def count(self, name: str, increment: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def get_count(self, name: str) -> int:
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def start_epoch(self):
+        with self.lock:
+            self.span_totals.clear()
+            self.span_counts.clear()
+            self.counters.clear()
+            self.epoch_start = time.perf_counter()
+
+    def end_epoch(self, epoch: int, stream_path: Optional[str] = None) -> dict:
+        """ Summarizes the epoch and appends it as one JSON line to stream_path. """
+        wall_time = time.perf_counter() - self.epoch_start
+        with self.lock:
+            record = {
+                'epoch': epoch,
+                'timestamp': time.time(),
+                'wall_time': wall_time,
+                'spans': {name: {'count': self.span_counts[name], 'total': self.span_totals[name]}
+                          for name in sorted(self.span_totals)},
+                'counters': dict(self.counters),
+                'games_per_second': self.counters.get('games', 0) / wall_time,
+                'decisions_per_second': self.counters.get('decisions', 0) / wall_time,
+            }
+        if stream_path is not None:
+            with open(stream_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return record
+
+    def start_profile(self):
+        """ Profiles the calling thread until dump_profile. """
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def dump_profile(self, path: str):
+        profiler, self.profiler = self.profiler, None
+        profiler.disable()
+        pstats.Stats(profiler).dump_stats(path)
+
+
+METRICS = Metrics()
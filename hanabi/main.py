@@ -3,7 +3,9 @@ import logging
 import socket
 import sys
 
+from CompiledAgent import CompiledAgent
 from GeneticAgent import GeneticAgent
+from SearchAgent import SearchAgent
 from SocketAgent import SocketAgent
 
 if __name__ == "__main__":
@@ -11,7 +13,17 @@ if __name__ == "__main__":
 
     with open('best_agent.json', 'r') as f:
         loaded_gent = GeneticAgent.from_json_encoded(json.load(f))
+    if len(sys.argv) > 1 and sys.argv[1] == 'search':
+        # searches every move, with the loaded genome as rollout policy
+        loaded_gent = SearchAgent(loaded_gent.name, loaded_gent.to_json_encoded()['rules'])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'compiled':
+        # the genome's decisions through lookup tables, with thresholds rounded to the table resolution
+        loaded_gent = CompiledAgent(loaded_gent)
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        agent = SocketAgent(s, loaded_gent)
-        agent.play_game()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            agent = SocketAgent(s, loaded_gent)
+            agent.play_game()
+    finally:
+        if isinstance(loaded_gent, SearchAgent):
+            loaded_gent.close()  # stops the rollout workers
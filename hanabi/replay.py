@@ -0,0 +1,186 @@
+import argparse
+import json
+import pickle
+import random
+import statistics
+import sys
+import time
+from typing import List, Callable, Optional, Dict
+
+import GameData
+from Agent import Agent
+from CompiledAgent import CompiledAgent, table_resolution_genome
+from GeneticAgent import GeneticAgent
+from game import Game
+from headless_game import notify_action_performed, play_until_game_over, action_key
+
+REPLAY_FILE = 'replays.pkl'
+
+
+def snapshot(data):
+    """ Copy of server data, states refer to the live hands and piles of the game. """
+    return pickle.loads(pickle.dumps(data))
+
+
+class GameRecorder:
+    """
+    Wraps a started game.Game and records, for every valid action, the game state seen by the acting player, the hands
+    of all players, the action and its result. Used in place of the game, see record_headless_game.
+    """
+
+    def __init__(self, game: Game, seed: Optional[int] = None):
+        self.game = game
+        players = [player.name for player in game.getPlayers()]
+        self.record = {
+            'seed': seed,
+            'players': players,
+            'initial_states': {name: self.get_state(name) for name in players},
+            'turns': [],
+            'score': None,
+        }
+
+    def get_state(self, player_name: str) -> GameData.ServerGameStateData:
+        return snapshot(self.game.satisfyRequest(GameData.ClientGetGameStateRequest(player_name), player_name)[0])
+
+    def getCurrentPlayerName(self) -> str:
+        return self.game.getCurrentPlayerName()
+
+    def satisfyRequest(self, data: GameData.ClientToServerData, playerName: str):
+        if type(data) is GameData.ClientGetGameStateRequest:
+            return self.game.satisfyRequest(data, playerName)
+        state = self.get_state(playerName)
+        hands = {player.name: snapshot(player.hand) for player in self.game.getPlayers()}
+        single_data, multiple_data = self.game.satisfyRequest(data, playerName)
+        if single_data is None:
+            self.record['turns'].append({'player': playerName, 'state': state, 'hands': hands,
+                                         'action': snapshot(data), 'result': snapshot(multiple_data)})
+            if type(multiple_data) is GameData.ServerGameOver:
+                self.record['score'] = multiple_data.score
+        return single_data, multiple_data
+
+
+def record_headless_game(agents: List[Agent], seed: Optional[int] = None) -> dict:
+    """ Like headless_game.play_headless_game, but returns the record of the game. """
+    game = Game()
+    for agent in agents:
+        game.addPlayer(agent.name)
+    game.start(seed)
+    recorder = GameRecorder(game, seed)
+    for agent in agents:
+        agent.update_game_state(recorder.record['initial_states'][agent.name])
+    play_until_game_over(recorder, agents)
+    return recorder.record
+
+
+def save_replays(records: List[dict], path: str = REPLAY_FILE):
+    with open(path, 'wb') as f:
+        pickle.dump(records, f)
+
+
+def load_replays(path: str = REPLAY_FILE) -> List[dict]:
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def evaluate_decisions(records: List[dict], make_agent: Callable[[str], Agent]) -> dict:
+    """
+    Asks fresh agents for the action of every recorded turn and compares it with the recorded action. Agents follow
+    the recorded game, whatever they choose, so every position is the recorded one. The global random generator is
+    seeded with the seed of each game, so deterministic agents are reproducible.
+    """
+    latencies = []
+    agreements: Dict[str, List[int]] = {}
+    for record in records:
+        random.seed(record['seed'])
+        agents = {name: make_agent(name) for name in record['players']}
+        for name, agent in agents.items():
+            agent.update_game_state(record['initial_states'][name])
+        for turn in record['turns']:
+            agent = agents[turn['player']]
+            agent.update_game_state(turn['state'])
+            start = time.perf_counter()
+            action = agent.choose_action()
+            latencies.append(time.perf_counter() - start)
+            action_type = type(turn['action']).__name__
+            agreements.setdefault(action_type, [0, 0])
+            agreements[action_type][0] += action is not None and action_key(action) == action_key(turn['action'])
+            agreements[action_type][1] += 1
+            if type(turn['result']) is not GameData.ServerGameOver:
+                notify_action_performed(list(agents.values()), turn['result'])
+    num_agreeing = sum(agreeing for agreeing, _ in agreements.values())
+    ordered = sorted(latencies)
+    return {
+        'games': len(records),
+        'decisions': len(latencies),
+        'agreement': num_agreeing / max(1, len(latencies)),
+        'agreement_by_action': {action_type: agreeing / total for action_type, (agreeing, total) in agreements.items()},
+        'latency_mean_us': statistics.mean(latencies) * 1e6 if latencies else 0.,
+        'latency_median_us': statistics.median(latencies) * 1e6 if latencies else 0.,
+        'latency_p95_us': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1e6 if latencies else 0.,
+    }
+
+
+def load_genome(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def record_genome_games(encoded_genome: dict, seeds: List[int]) -> List[dict]:
+    """ Records games of a genome playing with itself, one per seed. """
+    records = []
+    for game_seed in seeds:
+        random.seed(game_seed)
+        records.append(record_headless_game(
+            [GeneticAgent.from_json_encoded({'name': f'seat{i}', 'rules': encoded_genome['rules']}) for i in range(4)],
+            game_seed))
+    return records
+
+
+def check_compiled(encoded_genome: dict, seeds: List[int]) -> dict:
+    """
+    Replays games of the rule walk at table resolution, see CompiledAgent.table_resolution_genome, to the CompiledAgent
+    of the genome. The two agree on every decision if the compilation is correct.
+    """
+    records = record_genome_games(table_resolution_genome(encoded_genome), seeds)
+    return evaluate_decisions(records, lambda name: CompiledAgent(
+        GeneticAgent.from_json_encoded({'name': name, 'rules': encoded_genome['rules']})))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Records headless games and replays their decisions to agents.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help="record games of a genome playing with itself")
+    record_parser.add_argument('--genome', default='best_agent.json')
+    record_parser.add_argument('--games', type=int, default=100)
+    record_parser.add_argument('--seed', type=int, default=0, help="seed of the first game")
+    record_parser.add_argument('--output', default=REPLAY_FILE)
+    evaluate_parser = subparsers.add_parser('evaluate', help="replay recorded decisions to a genome")
+    evaluate_parser.add_argument('--genome', default='best_agent.json')
+    evaluate_parser.add_argument('--replays', default=REPLAY_FILE)
+    evaluate_parser.add_argument('--compiled', action='store_true', help="replay to the CompiledAgent of the genome")
+    check_parser = subparsers.add_parser('check-compiled', help="check that a compiled genome takes the decisions of "
+                                                                "its rule walk at table resolution")
+    check_parser.add_argument('--genome', default='best_agent.json')
+    check_parser.add_argument('--games', type=int, default=20)
+    check_parser.add_argument('--seed', type=int, default=0, help="seed of the first game")
+    arguments = parser.parse_args()
+
+    genome = load_genome(arguments.genome)
+    if arguments.command == 'record':
+        replays = record_genome_games(genome, list(range(arguments.seed, arguments.seed + arguments.games)))
+        save_replays(replays, arguments.output)
+        print(f"Recorded {len(replays)} games, {sum(len(replay['turns']) for replay in replays)} turns, mean score "
+              f"{statistics.mean(replay['score'] for replay in replays):.2f}.")
+    elif arguments.command == 'evaluate':
+        def make_agent(name: str) -> Agent:
+            agent = GeneticAgent.from_json_encoded({'name': name, 'rules': genome['rules']})
+            return CompiledAgent(agent) if arguments.compiled else agent
+        report = evaluate_decisions(load_replays(arguments.replays), make_agent)
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        report = check_compiled(genome, list(range(arguments.seed, arguments.seed + arguments.games)))
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        if report['agreement'] < 1:
+            sys.exit(1)
@@ -23,23 +23,85 @@ status = statuses[0]
 
 commandQueue = {}
 numPlayers = 2
+# seeds of the players that asked for the next game of a session
+nextGameRequests = {}
+# fast start, see GameData.ClientJoinTableRequest
+seatsOf = {}  # player name -> names of the players sharing its connection
+tableSeats = []  # players that joined ready, they don't send ClientPlayerReadyData
+tableSize = 0
+tableSeed = None
+
+
+def broadcast(data):
+    '''
+    Sends data once to every connection, whatever the number of players sitting at it.
+    '''
+    connections = []
+    for player in playerConnections:
+        if playerConnections[player][0] not in connections:
+            connections.append(playerConnections[player][0])
+    for conn in connections:
+        conn.send(data.serialize())
+
+
+def startGameIfReady():
+    '''
+    Starts the game once every player is ready and the table is full. Called with the mutex held.
+    '''
+    if len(game.getPlayers()) != game.getNumReadyPlayers() or len(game.getPlayers()) < max(numPlayers, tableSize):
+        return
+    listNames = []
+    for player in game.getPlayers():
+        listNames.append(player.name)
+    logging.info(
+        "Game start! Between: " + str(listNames))
+    broadcast(GameData.ServerStartGameData(listNames))
+    game.start(tableSeed)
+    for _ in tableSeats:
+        playersOk.append(1)
+
+
+def requestNextGame(playerName, seed):
+    '''
+    Sessions: once every connected player asked for it, a new game replaces the current one, with the same players
+    in the same order and without going through the lobby again. Called with the mutex held.
+    '''
+    global game
+    for seat in seatsOf[playerName]:
+        nextGameRequests[seat] = seed
+    if len(nextGameRequests) < len(playerConnections):
+        return
+    seed = next(iter(nextGameRequests.values()))
+    nextGameRequests.clear()
+    listNames = [player.name for player in game.getPlayers()]
+    game = Game()
+    for name in listNames:
+        game.addPlayer(name)
+    game.start(seed)
+    logging.info("Next game start! Between: " + str(listNames) + ", seed: " + str(seed))
+    broadcast(GameData.ServerStartGameData(listNames))
 
 
 def manageConnection(conn: socket, addr):
     global status
     global game
+    global tableSize
+    global tableSeed
     with conn:
         logging.info("Connected by: " + str(addr))
         keepActive = True
         playerName = ""
+        seats = []
         while keepActive:
             print("SERVER WAITING")
             data = conn.recv(DATASIZE)
             mutex.acquire(True)
             if not data:
-                del playerConnections[playerName]
-                logging.warning("Player disconnected: " + playerName)
-                game.removePlayer(playerName)
+                for seat in seats:
+                    del playerConnections[seat]
+                    nextGameRequests.pop(seat, None)
+                    logging.warning("Player disconnected: " + seat)
+                    game.removePlayer(seat)
                 if len(playerConnections) == 0:
                     logging.info("Shutting down server")
                     os._exit(0)
@@ -48,6 +110,9 @@ def manageConnection(conn: socket, addr):
                 print(f"SERVER PROCESSING {GameData.GameData.deserialize(data)}")
                 data = GameData.GameData.deserialize(data)
                 print(f"SERVER RECEIVED {type(data)} from {data.sender}")
+                # a connection with several seats acts for the seat named as sender
+                if data.sender in seats:
+                    playerName = data.sender
                 if status == "Lobby":
                     if type(data) is GameData.ClientPlayerAddData:
                         playerName = data.sender
@@ -58,6 +123,8 @@ def manageConnection(conn: socket, addr):
                             mutex.release()
                             return
                         playerConnections[playerName] = (conn, addr)
+                        seats = [playerName]
+                        seatsOf[playerName] = seats
                         logging.info("Player connected: " + playerName)
                         game.addPlayer(playerName)
                         conn.send(GameData.ServerPlayerConnectionOk(
@@ -66,16 +133,29 @@ def manageConnection(conn: socket, addr):
                         game.setPlayerReady(playerName)
                         logging.info("Player ready: " + playerName)
                         conn.send(GameData.ServerPlayerStartRequestAccepted(len(game.getPlayers()), game.getNumReadyPlayers()).serialize())
-                        if len(game.getPlayers()) == game.getNumReadyPlayers() and len(game.getPlayers()) >= numPlayers:
-                            listNames = []
-                            for player in game.getPlayers():
-                                listNames.append(player.name)
-                            logging.info(
-                                "Game start! Between: " + str(listNames))
-                            for player in playerConnections:
-                                playerConnections[player][0].send(
-                                    GameData.ServerStartGameData(listNames).serialize())
-                            game.start()
+                        startGameIfReady()
+                    # Join, start request and ready in a single request, the answer is the game start
+                    elif type(data) is GameData.ClientJoinTableRequest:
+                        if len(data.seats) == 0 or any(seat in playerConnections.keys() or seat == "" or seat is None
+                                                       for seat in data.seats):
+                            logging.warning("Duplicate player: " + str(data.seats))
+                            conn.send(GameData.ServerActionInvalid("Player with that name already registered.").serialize())
+                            mutex.release()
+                            return
+                        seats = list(data.seats)
+                        playerName = seats[0]
+                        for seat in seats:
+                            playerConnections[seat] = (conn, addr)
+                            seatsOf[seat] = seats
+                            commandQueue[seat] = []
+                            game.addPlayer(seat)
+                            game.setPlayerReady(seat)
+                            tableSeats.append(seat)
+                        logging.info("Players connected and ready: " + str(seats))
+                        tableSize = max(tableSize, data.numPlayers)
+                        if tableSeed is None:
+                            tableSeed = data.seed
+                        startGameIfReady()
                     # This ensures every player is ready to send requests
                     elif type(data) is GameData.ClientPlayerReadyData:
                         playersOk.append(1)
@@ -84,43 +164,45 @@ def manageConnection(conn: socket, addr):
                         status = "Game"
                         for player in commandQueue:
                             for cmd in commandQueue[player]:
+                                if type(cmd) is GameData.ClientNextGameRequest:
+                                    requestNextGame(player, cmd.seed)
+                                    continue
                                 singleData, multipleData = game.satisfyRequest(
                                     cmd, player)
                                 if singleData is not None:
                                     playerConnections[player][0].send(
                                         singleData.serialize())
                                 if multipleData is not None:
-                                    for id in playerConnections:
-                                        playerConnections[id][0].send(
-                                            multipleData.serialize())
-                                        if game.isGameOver():
-                                            os._exit(0)
+                                    broadcast(multipleData)
+                                    if game.isGameOver():
+                                        os._exit(0)
                         commandQueue.clear()
                     elif type(data) is not GameData.ClientPlayerAddData and type(
                             data) is not GameData.ClientPlayerStartRequest and type(
-                            data) is not GameData.ClientPlayerReadyData:
+                            data) is not GameData.ClientPlayerReadyData and type(
+                            data) is not GameData.ClientJoinTableRequest:
                         commandQueue[playerName].append(data)
                 # In game
+                elif status == "Game" and type(data) is GameData.ClientNextGameRequest:
+                    requestNextGame(playerName, data.seed)
                 elif status == "Game":
                     singleData, multipleData = game.satisfyRequest(
                         data, playerName)
                     if singleData is not None:
                         conn.send(singleData.serialize())
                     if multipleData is not None:
-                        for id in playerConnections:
-                            playerConnections[id][0].send(
-                                multipleData.serialize())
-                            if game.isGameOver():
-                                logging.info("Game over")
-                                logging.info("Game score: " +
-                                             str(game.getScore()))
-                                # os._exit(0)
-                                players = game.getPlayers()
-                                game = Game()
-                                for player in players:
-                                    logging.info("Starting new game")
-                                    game.addPlayer(player.name)
-                                game.start()
+                        broadcast(multipleData)
+                        if game.isGameOver():
+                            logging.info("Game over")
+                            logging.info("Game score: " +
+                                         str(game.getScore()))
+                            # os._exit(0)
+                            players = game.getPlayers()
+                            game = Game()
+                            for player in players:
+                                logging.info("Starting new game")
+                                game.addPlayer(player.name)
+                            game.start()
             mutex.release()
 
 
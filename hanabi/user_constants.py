@@ -39,3 +39,18 @@ MOVE_RULE_TWO_UP_PROB = 0.1
 CROSSOVER_SWITCH_RULE_PROB = 0.1
 CHOOSE_STRONG_PARENT_PROB = 0.8
 SAVE_RESULTS_AFTER_EPOCHS = 10
+SURROGATE_NUM_CANDIDATES = 8
+SURROGATE_CONTROL_PROB = 0.125  # share of offspring bred without the prescreen, to measure its effect
+SURROGATE_MIN_SAMPLES = 20
+SURROGATE_RIDGE_PENALTY = 1.0
+SURROGATE_CHECKPOINT_PATTERN = 'training_*.json'
+METRICS_STREAM_FILE = 'training_metrics.jsonl'
+SEARCH_TIME_BUDGET = 1.0
+SEARCH_NUM_WORKERS = 4
+SEARCH_MAX_HINT_CANDIDATES = 6
+POLICY_TABLE_RESOLUTION = 64
+GAME_LOG_CHUNK_ROWS = 1 << 20
+GAME_LOG_CHUNK_GAMES = 1000
+GAME_LOG_FLUSH_SECONDS = 60
+DEAL_CORPUS_SIZE = 10000
+WARM_POOL_NUM_WORKERS = 4
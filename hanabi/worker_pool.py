@@ -0,0 +1,70 @@
+import logging
+import multiprocessing
+import random
+import time
+from typing import List, Optional
+
+from evaluation_broker import run_job
+from game import Game
+from user_constants import DEAL_CORPUS_SIZE, WARM_POOL_NUM_WORKERS
+
+NUM_CARDS = 50
+# modules imported once by the fork server, every worker is forked from it with them already loaded
+PRELOADED_MODULES = ['GameData', 'game', 'PlayerGameState', 'HintEngine', 'PlayRule', 'HintRule', 'DiscardRule',
+                     'GeneticAgent', 'headless_game', 'evaluation_broker', 'worker_pool']
+
+
+def build_deal_corpus(size: int) -> bytes:
+    """
+    Deck orders of the seeds 0 to size - 1, see Game.start. A single bytes object, so that forked workers share its
+    pages, reference counting of a list of ints would copy them.
+    """
+    corpus = bytearray()
+    for seed in range(size):
+        order = list(range(NUM_CARDS))
+        random.Random(seed).shuffle(order)
+        corpus += bytes(order)
+    return bytes(corpus)
+
+
+def deal_order(seed: int) -> Optional[bytes]:
+    if 0 <= seed < DEAL_CORPUS_SIZE:
+        return DEAL_CORPUS[seed * NUM_CARDS:(seed + 1) * NUM_CARDS]
+    return None
+
+
+def run_corpus_job(job: dict) -> dict:
+    """ evaluation_broker.run_job, with the deck of the seed from the corpus if it is there. """
+    return run_job(job, deck_order=deal_order(job['seed']))
+
+
+# built on import, that is once in the fork server, and shared copy-on-write by the workers
+DEAL_CORPUS = build_deal_corpus(DEAL_CORPUS_SIZE)
+Game()  # builds the class level card list
+
+
+class WarmWorkerPool:
+    """
+    Process pool for evaluation games whose workers fork from a preloaded fork server, so that starting a worker
+    costs no imports nor table building. Falls back to fork, then spawn, where fork servers are not available.
+    Has the interface of evaluation_broker.BrokerClient, so it can be passed as broker to Population.
+    """
+
+    def __init__(self, num_workers: int = WARM_POOL_NUM_WORKERS):
+        start_methods = multiprocessing.get_all_start_methods()
+        start_method = next(method for method in ('forkserver', 'fork', 'spawn') if method in start_methods)
+        context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            context.set_forkserver_preload(PRELOADED_MODULES)
+        start = time.perf_counter()
+        self.pool = context.Pool(num_workers)
+        logging.info(f"Started {num_workers} {start_method} workers in {time.perf_counter() - start:.3f}s.")
+
+    def evaluate(self, genome_sets: List[List[dict]], seeds: List[int]) -> List[dict]:
+        """ Results of the games, see evaluation_broker.run_job. """
+        return self.pool.map(run_corpus_job, [{'genomes': genomes, 'seed': seed}
+                                              for genomes, seed in zip(genome_sets, seeds)])
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()